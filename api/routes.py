@@ -1,14 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, Security, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, Security, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import APIKeyHeader
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import func, desc
-from database.connection import get_db
-from database.models import ModerationLog, Warning, GroupConfig
+from sqlalchemy import func, desc, tuple_
+from database.connection import ApiSessionLocal, get_api_db
+from database.replica import get_replica_db
+from database.models import (
+    ActiveRestriction, ModerationLog, Warning as WarningModel, GroupConfig, StatCounter, ActionCount, GroupActivity,
+    UserWarningCount
+)
+from database.rollups import TOTAL_ACTIONS, TOTAL_USERS, TOTAL_WARNINGS, action_type
+from database.writer import log_writer
+from profiling import PROFILE_INTERVAL, profiler
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import Callable, List, Optional, Dict, Any
+from collections import Counter
+import base64
+import csv
+import io
+import json
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 
 router = APIRouter(prefix="/api")
 
@@ -25,6 +38,36 @@ async def get_api_key(api_key_header: str = Security(api_key_header)):
         detail="Invalid API Key",
     )
 
+# Header carrying the cursor for the next page of a keyset-paginated list
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(values: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, dict):
+            raise ValueError("cursor must encode an object")
+        return values
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor",
+        )
+
+# Tables and columns available through /export, and the rows fetched per round trip
+EXPORT_TABLES = {
+    "logs": (ModerationLog, ["id", "group_id", "user_id", "admin_id", "action", "created_at"]),
+    "warnings": (WarningModel, ["id", "group_id", "user_id", "admin_id", "reason", "created_at"]),
+}
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+EXPORT_BATCH_SIZE = 1000
+
 # Pydantic models for API responses
 class Log(BaseModel):
     id: int
@@ -52,34 +95,69 @@ class Group(BaseModel):
     created_at: str
     updated_at: Optional[str]
 
+class Restriction(BaseModel):
+    group_id: int
+    user_id: int
+    kind: str
+    admin_id: int
+    until_date: Optional[str]
+    created_at: str
+
 class Stats(BaseModel):
     total_groups: int
     total_users: int
     total_warnings: int
     total_actions: int
     actions_by_type: Dict[str, int]
+    # actions_by_type grouped by the kind of action, such as warn, mute or join
+    actions_by_kind: Dict[str, int]
     most_active_groups: List[Dict[str, Any]]
     most_warned_users: List[Dict[str, Any]]
 
+# Extra /health sections, registered by components the API does not import
+health_checks: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
 @router.get("/health")
 def health_check():
-    return {"status": "ok"}
+    health = {"status": "ok", "log_queue": log_writer.stats()}
+    for name, check in health_checks.items():
+        health[name] = check()
+    return health
 
 @router.get("/logs", response_model=List[Log])
 async def get_logs(
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
+    cursor: Optional[str] = None,
     group_id: Optional[int] = None,
     user_id: Optional[int] = None,
     admin_id: Optional[int] = None,
     action: Optional[str] = None,
     api_key: str = Depends(get_api_key),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_replica_db)
 ):
     """
-    Get moderation logs with optional filtering.
+    Get moderation logs with optional filtering, newest first.
+
+    Pass the X-Next-Cursor header of a response as `cursor` to fetch the next
+    page; the header is omitted on the last page. `skip` is still accepted
+    but gets slower the deeper it pages.
     """
-    query = select(ModerationLog).order_by(desc(ModerationLog.created_at)).offset(skip).limit(limit)
+    query = select(ModerationLog).order_by(
+        desc(ModerationLog.created_at), desc(ModerationLog.id)
+    ).limit(limit)
+
+    # Continue after the last row of the previous page
+    if cursor:
+        position = decode_cursor(cursor)
+        try:
+            after = (datetime.fromisoformat(position["created_at"]), int(position["id"]))
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        query = query.where(tuple_(ModerationLog.created_at, ModerationLog.id) < after)
+    elif skip:
+        query = query.offset(skip)
 
     # Apply filters if provided
     if group_id:
@@ -94,6 +172,12 @@ async def get_logs(
     result = await db.execute(query)
     logs = result.scalars().all()
 
+    if logs and len(logs) == limit:
+        last = logs[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            {"created_at": last.created_at.isoformat(), "id": last.id}
+        )
+
     return [
         Log(
             id=log.id,
@@ -111,15 +195,15 @@ async def get_user_warnings(
     user_id: int,
     group_id: Optional[int] = None,
     api_key: str = Depends(get_api_key),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_replica_db)
 ):
     """
     Get warnings for a specific user, optionally filtered by group.
     """
-    query = select(Warning).where(Warning.user_id == user_id).order_by(desc(Warning.created_at))
+    query = select(WarningModel).where(WarningModel.user_id == user_id).order_by(desc(WarningModel.created_at))
 
     if group_id:
-        query = query.where(Warning.group_id == group_id)
+        query = query.where(WarningModel.group_id == group_id)
 
     result = await db.execute(query)
     warnings = result.scalars().all()
@@ -136,20 +220,79 @@ async def get_user_warnings(
         for warning in warnings
     ]
 
+@router.get("/restrictions", response_model=List[Restriction])
+async def get_restrictions(
+    group_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    kind: Optional[str] = None,
+    limit: int = 100,
+    api_key: str = Depends(get_api_key),
+    db: AsyncSession = Depends(get_api_db)
+):
+    """
+    Get restrictions currently in force, such as mutes, soonest to end first.
+    Filtering by group or user is served by the primary key or the user index.
+    """
+    now = datetime.now(timezone.utc)
+    query = select(ActiveRestriction).where(
+        (ActiveRestriction.until_date.is_(None)) | (ActiveRestriction.until_date > now)
+    ).order_by(ActiveRestriction.until_date.asc().nulls_last()).limit(limit)
+
+    if group_id:
+        query = query.where(ActiveRestriction.group_id == group_id)
+    if user_id:
+        query = query.where(ActiveRestriction.user_id == user_id)
+    if kind:
+        query = query.where(ActiveRestriction.kind == kind)
+
+    result = await db.execute(query)
+    restrictions = result.scalars().all()
+
+    return [
+        Restriction(
+            group_id=restriction.group_id,
+            user_id=restriction.user_id,
+            kind=restriction.kind,
+            admin_id=restriction.admin_id,
+            until_date=restriction.until_date.isoformat() if restriction.until_date else None,
+            created_at=restriction.created_at.isoformat()
+        )
+        for restriction in restrictions
+    ]
+
 @router.get("/groups", response_model=List[Group])
 async def get_groups(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     api_key: str = Depends(get_api_key),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_replica_db)
 ):
     """
-    Get all groups with their configurations.
+    Get all groups with their configurations, ordered by group id.
+
+    Pages are linked through the X-Next-Cursor header, as for /logs.
     """
-    query = select(GroupConfig).order_by(GroupConfig.group_id).offset(skip).limit(limit)
+    query = select(GroupConfig).order_by(GroupConfig.group_id).limit(limit)
+
+    # Continue after the last group of the previous page
+    if cursor:
+        position = decode_cursor(cursor)
+        try:
+            after = int(position["group_id"])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        query = query.where(GroupConfig.group_id > after)
+    elif skip:
+        query = query.offset(skip)
+
     result = await db.execute(query)
     groups = result.scalars().all()
 
+    if groups and len(groups) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor({"group_id": groups[-1].group_id})
+
     return [
         Group(
             id=group.id,
@@ -167,59 +310,45 @@ async def get_groups(
 @router.get("/stats", response_model=Stats)
 async def get_stats(
     api_key: str = Depends(get_api_key),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_replica_db)
 ):
     """
     Get overall statistics about the bot's usage.
+
+    Everything except the group count is read from rollup tables that are
+    maintained as logs and warnings are written.
     """
     # Total groups
     total_groups_query = select(func.count(GroupConfig.id))
     total_groups_result = await db.execute(total_groups_query)
     total_groups = total_groups_result.scalar() or 0
 
-    # Total unique users (from warnings and logs)
-    total_users_query = select(
-        func.count(
-            func.distinct(
-                func.coalesce(ModerationLog.user_id, Warning.user_id)
-            )
-        )
-    ).select_from(
-        func.full_outer_join(
-            ModerationLog,
-            Warning,
-            ModerationLog.user_id == Warning.user_id
-        ).alias()
-    )
-    total_users_result = await db.execute(total_users_query)
-    total_users = total_users_result.scalar() or 0
-
-    # Total warnings
-    total_warnings_query = select(func.count(Warning.id))
-    total_warnings_result = await db.execute(total_warnings_query)
-    total_warnings = total_warnings_result.scalar() or 0
-
-    # Total actions
-    total_actions_query = select(func.count(ModerationLog.id))
-    total_actions_result = await db.execute(total_actions_query)
-    total_actions = total_actions_result.scalar() or 0
+    # Total users, warnings and actions
+    counters_query = select(StatCounter.name, func.sum(StatCounter.value)).where(
+        StatCounter.name.in_([TOTAL_USERS, TOTAL_WARNINGS, TOTAL_ACTIONS])
+    ).group_by(StatCounter.name)
+    counters_result = await db.execute(counters_query)
+    counters = {name: int(value) for name, value in counters_result.all()}
+    total_users = counters.get(TOTAL_USERS, 0)
+    total_warnings = counters.get(TOTAL_WARNINGS, 0)
+    total_actions = counters.get(TOTAL_ACTIONS, 0)
 
     # Actions by type
-    actions_by_type_query = select(
-        ModerationLog.action,
-        func.count(ModerationLog.id).label("count")
-    ).group_by(ModerationLog.action)
+    actions_by_type_query = select(ActionCount.action, ActionCount.count)
     actions_by_type_result = await db.execute(actions_by_type_query)
     actions_by_type = {
         action: count
         for action, count in actions_by_type_result.all()
     }
+    actions_by_kind = Counter()
+    for action, count in actions_by_type.items():
+        actions_by_kind[action_type(action)] += count
 
     # Most active groups
     most_active_groups_query = select(
-        ModerationLog.group_id,
-        func.count(ModerationLog.id).label("action_count")
-    ).group_by(ModerationLog.group_id).order_by(desc("action_count")).limit(5)
+        GroupActivity.group_id,
+        GroupActivity.action_count
+    ).order_by(desc(GroupActivity.action_count)).limit(5)
     most_active_groups_result = await db.execute(most_active_groups_query)
     most_active_groups = [
         {"group_id": group_id, "action_count": count}
@@ -228,9 +357,9 @@ async def get_stats(
 
     # Most warned users
     most_warned_users_query = select(
-        Warning.user_id,
-        func.count(Warning.id).label("warning_count")
-    ).group_by(Warning.user_id).order_by(desc("warning_count")).limit(5)
+        UserWarningCount.user_id,
+        UserWarningCount.warning_count
+    ).order_by(desc(UserWarningCount.warning_count)).limit(5)
     most_warned_users_result = await db.execute(most_warned_users_query)
     most_warned_users = [
         {"user_id": user_id, "warning_count": count}
@@ -243,6 +372,110 @@ async def get_stats(
         total_warnings=total_warnings,
         total_actions=total_actions,
         actions_by_type=actions_by_type,
+        actions_by_kind=dict(actions_by_kind),
         most_active_groups=most_active_groups,
         most_warned_users=most_warned_users
     )
+
+def _export_value(value):
+    # Timestamps as ISO 8601, like every other endpoint
+    return value.isoformat() if isinstance(value, datetime) else value
+
+async def stream_export(query, columns: List[str], fmt: str):
+    """
+    Yield the rows of a query as NDJSON or CSV text, one chunk per batch.
+    Rows come from a server-side cursor, so memory use does not grow with the export.
+    """
+    # The session must outlive the request handler, so it is opened here
+    async with ApiSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+        if fmt == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerow(columns)
+            yield buffer.getvalue()
+
+        async for rows in result.partitions():
+            buffer = io.StringIO()
+            if fmt == "csv":
+                writer = csv.writer(buffer)
+                for row in rows:
+                    writer.writerow([_export_value(value) for value in row])
+            else:
+                for row in rows:
+                    buffer.write(json.dumps({column: _export_value(value) for column, value in zip(columns, row)}))
+                    buffer.write("\n")
+            yield buffer.getvalue()
+
+@router.get("/export/{table}")
+async def export_rows(
+    table: str,
+    fmt: str = Query("ndjson", alias="format"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    group_id: Optional[int] = None,
+    api_key: str = Depends(get_api_key)
+):
+    """
+    Stream all moderation logs or warnings as NDJSON or CSV, oldest first.
+    `since` is inclusive and `until` is exclusive.
+    """
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown export table")
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Format must be ndjson or csv")
+
+    model, columns = EXPORT_TABLES[table]
+    query = select(*[getattr(model, column) for column in columns]).order_by(model.id)
+
+    # Apply filters if provided
+    if since:
+        query = query.where(model.created_at >= since)
+    if until:
+        query = query.where(model.created_at < until)
+    if group_id:
+        query = query.where(model.group_id == group_id)
+
+    return StreamingResponse(
+        stream_export(query, columns, fmt),
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{fmt}"'}
+    )
+
+@router.post("/profile/start")
+async def start_profile(
+    interval: float = PROFILE_INTERVAL,
+    api_key: str = Depends(get_api_key)
+):
+    """
+    Start sampling the stack of the running process every `interval` seconds.
+    The profile stops by itself after PROFILE_MAX_SECONDS.
+    """
+    if not 0.001 <= interval <= 1:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Interval must be between 0.001 and 1")
+    try:
+        # Runs on the event loop thread, which is the thread sampled
+        profiler.start(interval)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return {"status": "started", "interval": interval, "max_seconds": profiler.max_seconds}
+
+@router.post("/profile/stop")
+async def stop_profile(
+    format: str = "json",
+    top: int = 50,
+    api_key: str = Depends(get_api_key)
+):
+    """
+    Stop the running profile and return it: the busiest functions as JSON,
+    or with format=collapsed the raw stacks for flamegraph tools.
+    """
+    if format not in ("json", "collapsed"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Format must be json or collapsed")
+    try:
+        result = profiler.stop(top)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    if format == "collapsed":
+        return Response(content=result["collapsed"], media_type="text/plain")
+    return result
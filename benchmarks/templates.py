@@ -0,0 +1,81 @@
+"""
+Benchmark welcome/goodbye rendering for a burst of joins.
+
+Compares parsing the stored template with str.format on every join against
+rendering the compiled template, for individual and batched greetings.
+
+    python -m benchmarks.templates --events 100000
+"""
+import argparse
+import os
+import time
+from types import SimpleNamespace
+
+# Importing the bot package validates these, although nothing talks to Telegram
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "benchmark")
+os.environ.setdefault("BOT_TOKEN", "1:benchmark")
+
+from bot.greetings import template_fields
+from bot.templates import get_template
+
+TEMPLATE = "Welcome to {group}, {user}! First name: {first_name} {last_name}, username: {username}. Read the /rules."
+
+
+def make_users(count: int):
+    return [
+        SimpleNamespace(
+            id=user_id,
+            mention=f"[User {user_id}](tg://user?id={user_id})",
+            first_name=f"User {user_id}",
+            last_name="Raider" if user_id % 2 else None,
+            username=f"raider{user_id}" if user_id % 3 else None,
+        )
+        for user_id in range(count)
+    ]
+
+
+def timed(label: str, renders: int, fn):
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<40} {renders / elapsed:>12,.0f} renders/s  ({elapsed * 1000:.1f} ms)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=50000, help="joins in the burst")
+    parser.add_argument("--batch", type=int, default=30, help="members mentioned per batched message")
+    args = parser.parse_args()
+
+    chat = SimpleNamespace(id=-100, title="Benchmark Group")
+    users = make_users(args.events)
+    fields = [template_fields([user], chat, args.batch) for user in users]
+    batches = [users[i:i + args.batch] for i in range(0, len(users), args.batch)]
+    batch_fields = [template_fields(batch, chat, args.batch) for batch in batches]
+
+    print(f"{args.events} joins, template of {len(TEMPLATE)} characters\n")
+
+    print("Individual greetings")
+    baseline = timed("str.format on the stored text", args.events,
+                     lambda: [TEMPLATE.format(**values) for values in fields])
+    compiled = timed("compiled Template.render", args.events,
+                     lambda: [get_template(TEMPLATE, TEMPLATE).render(values) for values in fields])
+    print(f"{'speedup':<40} {baseline / compiled:>12.2f}x\n")
+
+    print(f"Batched greetings ({len(batches)} messages of up to {args.batch} members)")
+    baseline = timed("str.format on the stored text", len(batches),
+                     lambda: [TEMPLATE.format(**values) for values in batch_fields])
+    compiled = timed("compiled Template.render", len(batches),
+                     lambda: [get_template(TEMPLATE, TEMPLATE).render(values) for values in batch_fields])
+    print(f"{'speedup':<40} {baseline / compiled:>12.2f}x\n")
+
+    print("End to end: field values and rendering")
+    timed("template_fields + Template.render", args.events,
+          lambda: [get_template(TEMPLATE, TEMPLATE).render(template_fields([user], chat, args.batch))
+                   for user in users])
+
+
+if __name__ == "__main__":
+    main()
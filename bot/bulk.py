@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import re
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple, Union
+
+from pyrogram.enums import MessageEntityType
+from pyrogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+# Targets acted on at the same time; the outbound scheduler still applies its budgets
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", 5))
+# Maximum targets accepted by one mass command
+BULK_MAX_TARGETS = int(os.getenv("BULK_MAX_TARGETS", 500))
+# Minimum seconds between edits of the progress message
+BULK_PROGRESS_INTERVAL = float(os.getenv("BULK_PROGRESS_INTERVAL", 3))
+
+Target = Union[int, str]
+
+_DURATION = re.compile(r"^(\d+)([smhd])$")
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+_TOKEN = re.compile(r"@\w{4,}|\b\d{5,}\b")
+
+
+class Skip(Exception):
+    """
+    Raised by a bulk action to leave a target alone, e.g. because it is an admin.
+    """
+
+
+def parse_duration(token: str) -> Optional[int]:
+    """
+    Parse a duration such as "30m", "12h" or "7d" into seconds.
+    """
+    match = _DURATION.match(token.lower())
+    if not match:
+        return None
+    return int(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def _dedupe(targets: Iterable[Target]) -> List[Target]:
+    seen, unique = set(), []
+    for target in targets:
+        key = target.lower() if isinstance(target, str) else target
+        if key not in seen:
+            seen.add(key)
+            unique.append(target)
+    return unique
+
+
+def targets_from_message(message: Message) -> List[Target]:
+    """
+    Find users listed in a message, e.g. a forwarded list of spammers:
+    @usernames, numeric ids and mentions of users without a username.
+    """
+    text = message.text or message.caption or ""
+    targets: List[Target] = []
+    for entity in message.entities or message.caption_entities or []:
+        if entity.type == MessageEntityType.TEXT_MENTION and entity.user:
+            targets.append(entity.user.id)
+    for token in _TOKEN.findall(text):
+        targets.append(token if token.startswith("@") else int(token))
+    return targets
+
+
+def parse_targets(message: Message, with_duration: bool = False) -> Tuple[List[Target], List[str], Optional[int]]:
+    """
+    Collect a mass command's targets from its arguments and, if it replies to a
+    message, from that message. Returns (targets, unrecognized arguments, duration).
+    """
+    targets: List[Target] = []
+    unrecognized: List[str] = []
+    duration = None
+    for token in message.command[1:]:
+        if with_duration and duration is None and parse_duration(token) is not None:
+            duration = parse_duration(token)
+        elif token.startswith("@") and len(token) > 1:
+            targets.append(token)
+        elif token.isdigit():
+            targets.append(int(token))
+        else:
+            unrecognized.append(token)
+    if message.reply_to_message:
+        targets.extend(targets_from_message(message.reply_to_message))
+    return _dedupe(targets), unrecognized, duration
+
+
+class BulkResult:
+    def __init__(self, total: int):
+        self.total = total
+        # user ids acted on
+        self.done: List[int] = []
+        self.skipped: List[Tuple[Target, str]] = []
+        self.failed: List[Tuple[Target, str]] = []
+
+    @property
+    def finished(self) -> int:
+        return len(self.done) + len(self.skipped) + len(self.failed)
+
+
+async def run_bulk(
+    targets: List[Target],
+    action: Callable[[Target], Awaitable[int]],
+    concurrency: int = BULK_CONCURRENCY,
+    on_progress: Optional[Callable[[BulkResult], Awaitable[None]]] = None,
+    progress_interval: float = BULK_PROGRESS_INTERVAL,
+) -> BulkResult:
+    """
+    Apply `action` to every target with at most `concurrency` in flight.
+    The action returns the user id it acted on, or raises Skip or any error.
+    `on_progress` is called at most every `progress_interval` seconds.
+    """
+    result = BulkResult(len(targets))
+    queue: asyncio.Queue = asyncio.Queue()
+    for target in targets:
+        queue.put_nowait(target)
+
+    async def worker():
+        while True:
+            try:
+                target = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                result.done.append(await action(target))
+            except Skip as e:
+                result.skipped.append((target, str(e)))
+            except Exception as e:
+                result.failed.append((target, str(e)))
+
+    async def report():
+        reported = -1
+        while True:
+            await asyncio.sleep(progress_interval)
+            if result.finished != reported:
+                reported = result.finished
+                try:
+                    await on_progress(result)
+                except Exception as e:
+                    logger.warning(f"Error reporting bulk progress: {e}")
+
+    reporter = asyncio.create_task(report()) if on_progress else None
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(targets)) or 1)))
+    finally:
+        if reporter is not None:
+            reporter.cancel()
+    return result
+
+
+def describe_target(target: Target) -> str:
+    return target if isinstance(target, str) else f"`{target}`"
+
+
+def summarize(verb: str, result: BulkResult, limit: int = 20) -> str:
+    """
+    Final status text: counts, then skipped and failed targets with reasons.
+    """
+    lines = [f"{verb.capitalize()}: {len(result.done)}/{result.total} done"
+             f", {len(result.skipped)} skipped, {len(result.failed)} failed."]
+    for title, items in (("Skipped", result.skipped), ("Failed", result.failed)):
+        if not items:
+            continue
+        lines.append(f"\n**{title}:**")
+        for target, reason in items[:limit]:
+            lines.append(f"• {describe_target(target)}: {reason}")
+        if len(items) > limit:
+            lines.append(f"• … and {len(items) - limit} more")
+    return "\n".join(lines)
@@ -0,0 +1,167 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Union
+
+from pyrogram import Client
+
+from bot.state import on_invalidation
+
+# Admin roster cache configuration
+ADMIN_CACHE_TTL = float(os.getenv("ADMIN_CACHE_TTL", 300))
+ADMIN_CACHE_SIZE = int(os.getenv("ADMIN_CACHE_SIZE", 5000))
+BOT_RIGHTS_CACHE_TTL = float(os.getenv("BOT_RIGHTS_CACHE_TTL", 3600))
+
+# Peer resolution cache configuration
+PEER_CACHE_SIZE = int(os.getenv("PEER_CACHE_SIZE", 50000))
+PEER_CACHE_TTL = float(os.getenv("PEER_CACHE_TTL", 3600))
+
+# Group config cache configuration
+GROUP_CONFIG_CACHE_SIZE = int(os.getenv("GROUP_CONFIG_CACHE_SIZE", 10000))
+GROUP_CONFIG_CACHE_TTL = float(os.getenv("GROUP_CONFIG_CACHE_TTL", 600))
+
+# Largest id list accepted by a single get_users call
+GET_USERS_BATCH = 200
+
+
+class TTLCache:
+    """
+    Size-bounded mapping whose entries expire a fixed time after they were set.
+    When full, the least recently used entry is evicted first.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class PeerCache:
+    """
+    Users and chats seen by the bot, so display names and username lookups
+    do not need a round trip. Fed from incoming updates and filled in batches.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.users = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.chats = TTLCache(maxsize=maxsize, ttl=ttl)
+        # lowercase username -> user id
+        self.usernames = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def remember_user(self, user):
+        if user is None:
+            return
+        self.users.set(user.id, user)
+        if user.username:
+            self.usernames.set(user.username.lower(), user.id)
+
+    def remember_chat(self, chat):
+        if chat is not None:
+            self.chats.set(chat.id, chat)
+
+    async def get_users(self, client: Client, user_ids: Iterable[int]) -> Dict[int, Any]:
+        """
+        Resolve several users at once, fetching only the missing ones with
+        batched get_users calls.
+        """
+        found = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            user = self.users.get(user_id)
+            if user is None:
+                missing.append(user_id)
+            else:
+                found[user_id] = user
+
+        for i in range(0, len(missing), GET_USERS_BATCH):
+            for user in await client.get_users(missing[i:i + GET_USERS_BATCH]):
+                self.remember_user(user)
+                found[user.id] = user
+        return found
+
+    async def get_user(self, client: Client, user: Union[int, str]):
+        """
+        Resolve a single user by id, numeric string or @username.
+        """
+        if isinstance(user, str):
+            name = user.lstrip("@")
+            if name.lstrip("-").isdigit():
+                user = int(name)
+            else:
+                user_id = self.usernames.get(name.lower())
+                if user_id is None:
+                    resolved = await client.get_users(name)
+                    self.remember_user(resolved)
+                    return resolved
+                user = user_id
+
+        cached = self.users.get(user)
+        if cached is None:
+            cached = await client.get_users(user)
+            self.remember_user(cached)
+        return cached
+
+    async def get_chat(self, client: Client, chat_id: int):
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            chat = await client.get_chat(chat_id)
+            self.remember_chat(chat)
+        return chat
+
+
+# chat_id -> set of user ids holding the administrator or owner status
+admin_cache = TTLCache(maxsize=ADMIN_CACHE_SIZE, ttl=ADMIN_CACHE_TTL)
+
+# chat_id -> frozenset of the bot's own admin rights (empty when it is not an admin)
+bot_rights_cache = TTLCache(maxsize=ADMIN_CACHE_SIZE, ttl=BOT_RIGHTS_CACHE_TTL)
+
+# Shared user and chat lookups
+peer_cache = PeerCache(maxsize=PEER_CACHE_SIZE, ttl=PEER_CACHE_TTL)
+
+# group_id -> GroupConfig, or None for groups known to have no config row
+group_config_cache = TTLCache(maxsize=GROUP_CONFIG_CACHE_SIZE, ttl=GROUP_CONFIG_CACHE_TTL)
+
+# Drop entries when another worker reports that they changed
+on_invalidation({
+    "admins": admin_cache,
+    "bot_rights": bot_rights_cache,
+    "group_configs": group_config_cache,
+})
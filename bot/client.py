@@ -1,16 +1,45 @@
 import os
-from pyrogram import Client
 from dotenv import load_dotenv
 
+from bot.greetings import greetings
+from bot.notifier import owner_notifier
+from bot.restrictions import restriction_scheduler
+from bot.scheduler import ScheduledClient, outbound_scheduler
+from bot.state import state_backend
+from bot.utils import get_bot_id
+from database.writer import log_writer
+from metrics import instrument_handlers
+
 load_dotenv()
 
-bot = Client(
+# FloodWaits are handed to the outbound scheduler rather than slept on inside Pyrogram
+bot = ScheduledClient(
     "manager_bot",
     api_id=int(os.getenv("API_ID")),
     api_hash=os.getenv("API_HASH"),
     bot_token=os.getenv("BOT_TOKEN"),
-    plugins=dict(root="bot.handlers")
+    plugins=dict(root="bot.handlers"),
+    sleep_threshold=0
 )
 
 async def start_bot():
+    await state_backend.start()
+    await outbound_scheduler.start()
     await bot.start()
+    await instrument_handlers(bot)
+    # Resolve the bot's own identity once so rights checks never need get_me
+    await get_bot_id(bot)
+    await log_writer.start()
+    await restriction_scheduler.start()
+    await owner_notifier.start(bot)
+
+async def stop_bot():
+    # Send pending greetings and the last digest, and write out queued logs before the process exits
+    await greetings.stop()
+    await restriction_scheduler.stop()
+    await owner_notifier.stop()
+    await bot.stop()
+    await outbound_scheduler.stop()
+    await log_writer.stop()
+    await state_backend.close()
+
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from pyrogram import Client
+from pyrogram.types import Chat, User
+
+from bot.cache import TTLCache
+from bot.scheduler import Priority, outbound_priority
+from bot.templates import Template
+from bot.utils import log_action, log_actions
+
+logger = logging.getLogger(__name__)
+
+# Seconds over which joins (or leaves) in a chat are counted and batched
+GREETING_BATCH_WINDOW = float(os.getenv("GREETING_BATCH_WINDOW", 5))
+# Events within one window that are still greeted individually
+GREETING_BURST_THRESHOLD = int(os.getenv("GREETING_BURST_THRESHOLD", 3))
+# Users mentioned by name in one batched message; the rest are counted
+GREETING_MAX_MENTIONS = int(os.getenv("GREETING_MAX_MENTIONS", 30))
+# Maximum chats tracked at once
+GREETING_CHATS_SIZE = int(os.getenv("GREETING_CHATS_SIZE", 10000))
+
+
+def join_names(names: List[str], total: int) -> str:
+    """
+    Join names as "a, b and c", or "a, b and 5 others" if some were left out.
+    """
+    if total > len(names):
+        return f"{', '.join(names)} and {total - len(names)} others"
+    if len(names) == 1:
+        return names[0]
+    return f"{', '.join(names[:-1])} and {names[-1]}"
+
+
+def template_fields(users: List[User], chat: Chat, max_mentions: int) -> Dict[str, str]:
+    """
+    Values for a welcome or goodbye template; several users are listed in one field each.
+    """
+    shown = users[:max_mentions]
+    usernames = [f"@{user.username}" for user in shown if user.username]
+    return {
+        "user": join_names([user.mention for user in shown], len(users)),
+        "first_name": join_names([user.first_name for user in shown], len(users)),
+        "last_name": ", ".join(user.last_name for user in shown if user.last_name),
+        "username": ", ".join(usernames),
+        "group": chat.title,
+    }
+
+
+class _ChatEvents:
+    __slots__ = ("recent", "pending", "template", "task")
+
+    def __init__(self):
+        # Times of recent events, for the rate check
+        self.recent: Deque[float] = deque()
+        # (user, action) waiting for the batched message
+        self.pending: List[Tuple[User, str]] = []
+        self.template: Optional[Template] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+class GreetingAggregator:
+    """
+    Sends welcome and goodbye messages. At normal rates every member gets their
+    own message. Once more than `burst_threshold` joins (or leaves) arrive in a
+    chat within `window` seconds, further ones are collected and sent at the end
+    of the window as one message mentioning all of them, and their log entries
+    are queued together.
+    """
+
+    def __init__(self, window: float, burst_threshold: int, max_mentions: int, max_chats: int):
+        self.window = window
+        self.burst_threshold = burst_threshold
+        self.max_mentions = max_mentions
+        # (chat_id, kind) -> _ChatEvents
+        self._chats = TTLCache(maxsize=max_chats, ttl=window * 2)
+        self._tasks = set()
+        self.individual_messages = 0
+        self.batched_messages = 0
+        self.batched_events = 0
+
+    async def add(self, client: Client, chat: Chat, kind: str, user: User, action: str, template: Template):
+        """
+        Greet (or say goodbye to) one member, immediately or as part of a batch.
+        `kind` separates joins from leaves; `action` is the log entry.
+        """
+        key = (chat.id, kind)
+        events = self._chats.get(key)
+        if events is None:
+            events = _ChatEvents()
+        self._chats.set(key, events)
+
+        now = time.monotonic()
+        while events.recent and events.recent[0] <= now - self.window:
+            events.recent.popleft()
+        events.recent.append(now)
+
+        if not events.pending and len(events.recent) <= self.burst_threshold:
+            await self._send(client, chat, template, [user])
+            self.individual_messages += 1
+            await log_action(client, chat.id, user.id, 0, action)
+            return
+
+        # The latest template wins if it changes during the window
+        events.pending.append((user, action))
+        events.template = template
+        if events.task is None:
+            events.task = asyncio.create_task(self._flush_later(client, chat, events))
+            self._tasks.add(events.task)
+            events.task.add_done_callback(self._tasks.discard)
+
+    async def _flush_later(self, client: Client, chat: Chat, events: _ChatEvents):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            events.task = None
+            await self._flush(client, chat, events)
+
+    async def _flush(self, client: Client, chat: Chat, events: _ChatEvents):
+        pending, events.pending = events.pending, []
+        if not pending:
+            return
+        await self._send(client, chat, events.template, [user for user, _ in pending])
+        self.batched_messages += 1
+        self.batched_events += len(pending)
+        await log_actions([(chat.id, user.id, 0, action) for user, action in pending])
+
+    async def _send(self, client: Client, chat: Chat, template: Template, users: List[User]):
+        try:
+            text = template.render(template_fields(users, chat, self.max_mentions))
+            with outbound_priority(Priority.LOW):
+                await client.send_message(chat.id, text)
+        except Exception as e:
+            logger.error(f"Error sending greeting in {chat.id}: {e}")
+
+    async def stop(self):
+        """
+        Send every pending batch now rather than at the end of its window.
+        """
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "individual_messages": self.individual_messages,
+            "batched_messages": self.batched_messages,
+            "batched_events": self.batched_events,
+        }
+
+
+greetings = GreetingAggregator(
+    window=GREETING_BATCH_WINDOW,
+    burst_threshold=GREETING_BURST_THRESHOLD,
+    max_mentions=GREETING_MAX_MENTIONS,
+    max_chats=GREETING_CHATS_SIZE,
+)
@@ -1,57 +1,52 @@
-import asyncio
+import logging
 import time
-from datetime import datetime
+from datetime import datetime, timezone
 
 from pyrogram import Client, filters
-from pyrogram.enums import ChatMemberStatus
 from pyrogram.errors import ChatAdminRequired, UserAdminInvalid, FloodWait
 from pyrogram.types import Message, ChatPermissions
 from sqlalchemy.future import select
 
-from bot.utils import is_owner, get_target_user, bot_is_admin, log_action, check_cooldown, is_admin
+from bot.bulk import BULK_MAX_TARGETS, Skip, parse_duration, parse_targets, run_bulk, summarize
+from bot.cache import peer_cache
+from bot.pipeline import ANY_RIGHTS, CommandContext, command
+from bot.restrictions import MAX_RESTRICTION_SECONDS, MIN_RESTRICTION_SECONDS, MUTE, restriction_scheduler
+from bot.scheduler import Priority, outbound_priority
+from bot.utils import (
+    bot_can, log_action, log_actions, get_bot_id, get_chat_admins, get_group_config, add_warning,
+    remove_latest_warning
+)
 from database.connection import get_db
-from database.models import Warning, GroupConfig
+from database.models import Warning
 
+logger = logging.getLogger(__name__)
 
-@Client.on_message(filters.command("kick") & filters.group)
-async def kick(client: Client, message: Message):
-    # Check if user is admin or owner
-    if not await is_admin(client, message.chat.id, message.from_user.id) and not await is_owner(message):
-        return await message.reply("You need to be an admin to use this command.")
+# Durations Telegram honours; anything else would be a permanent mute
+INVALID_DURATION = "Mutes must last between 1 minute and 366 days."
 
-    # Check cooldown
-    if not await check_cooldown(message.from_user.id, "kick"):
-        return await message.reply("Please wait before using this command again.")
 
-    # Check if bot is admin
-    if not await bot_is_admin(client, message.chat.id):
-        return await message.reply("I need admin rights.")
+def valid_duration(duration: int) -> bool:
+    return MIN_RESTRICTION_SECONDS <= duration <= MAX_RESTRICTION_SECONDS
 
-    # Get target user
-    user_id = await get_target_user(client, message)
-    if not user_id:
-        return await message.reply("Please reply to a message or provide a username.")
 
-    try:
-        # Check if target user is an admin
-        target_member = await client.get_chat_member(message.chat.id, user_id)
-        if target_member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]:
-            return await message.reply("Cannot kick an admin.")
+@Client.on_message(filters.command("kick") & filters.group)
+@command("kick", admin=True, bot_right="can_restrict_members", target=True, protect_admins="kick")
+async def kick(client: Client, message: Message, ctx: CommandContext):
+    user_id = ctx.target_id
 
+    try:
         # Kick the user
         await client.ban_chat_member(message.chat.id, user_id)
         await client.unban_chat_member(message.chat.id, user_id)
 
         # Log the action
-        async for db in get_db():
-            await log_action(
-                client, 
-                db, 
-                message.chat.id, 
-                user_id, 
-                message.from_user.id, 
-                "kick"
-            )
+        await log_action(
+            client,
+            message.chat.id,
+            user_id,
+            message.from_user.id,
+            "kick"
+        )
 
         await message.reply(f"User kicked.")
     except UserAdminInvalid:
@@ -59,7 +54,6 @@ async def kick(client: Client, message: Message):
     except ChatAdminRequired:
         await message.reply("I need admin rights to perform this action.")
     except FloodWait as e:
-        await asyncio.sleep(e.value)
         await message.reply(f"Rate limited. Please try again in {e.value} seconds.")
     except Exception as e:
         await message.reply(f"Error: {str(e)}")
@@ -67,50 +61,29 @@ async def kick(client: Client, message: Message):
 
 
 @Client.on_message(filters.command("ban") & filters.group)
-async def ban(client: Client, message: Message):
-    # Check if user is admin or owner
-    if not await is_admin(client, message.chat.id, message.from_user.id) and not await is_owner(message):
-        return await message.reply("You need to be an admin to use this command.")
-
-    # Check cooldown
-    if not await check_cooldown(message.from_user.id, "ban"):
-        return await message.reply("Please wait before using this command again.")
-
-    # Check if bot is admin
-    if not await bot_is_admin(client, message.chat.id):
-        return await message.reply("I need admin rights.")
-
-    # Get target user
-    user_id = await get_target_user(client, message)
-    if not user_id:
-        return await message.reply("Please reply to a message or provide a username.")
+@command("ban", admin=True, bot_right="can_restrict_members", target=True, protect_admins="ban")
+async def ban(client: Client, message: Message, ctx: CommandContext):
+    user_id = ctx.target_id
 
     try:
-        # Check if target user is an admin
-        target_member = await client.get_chat_member(message.chat.id, user_id)
-        if target_member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]:
-            return await message.reply("Cannot ban an admin.")
-
         # Ban the user
         await client.ban_chat_member(message.chat.id, user_id)
 
         # Delete user's messages
-        if message.reply_to_message:
+        if message.reply_to_message and await bot_can(client, message.chat.id, "can_delete_messages"):
             try:
                 await message.reply_to_message.delete()
             except Exception:
                 pass
 
         # Log the action
-        async for db in get_db():
-            await log_action(
-                client, 
-                db, 
-                message.chat.id, 
-                user_id, 
-                message.from_user.id, 
-                "ban"
-            )
+        await log_action(
+            client,
+            message.chat.id,
+            user_id,
+            message.from_user.id,
+            "ban"
+        )
 
         await message.reply(f"User banned.")
         return None
@@ -121,7 +94,6 @@ async def ban(client: Client, message: Message):
         await message.reply("I need admin rights to perform this action.")
         return None
     except FloodWait as e:
-        await asyncio.sleep(e.value)
         await message.reply(f"Rate limited. Please try again in {e.value} seconds.")
         return None
     except Exception as e:
@@ -130,38 +102,21 @@ async def ban(client: Client, message: Message):
 
 
 @Client.on_message(filters.command("mute") & filters.group)
-async def mute(client: Client, message: Message):
-    # Check if user is admin or owner
-    if not await is_admin(client, message.chat.id, message.from_user.id) and not await is_owner(message):
-        return await message.reply("You need to be an admin to use this command.")
-
-    # Check cooldown
-    if not await check_cooldown(message.from_user.id, "mute"):
-        return await message.reply("Please wait before using this command again.")
-
-    # Check if bot is admin
-    if not await bot_is_admin(client, message.chat.id):
-        return await message.reply("I need admin rights.")
-
-    # Get target user
-    user_id = await get_target_user(client, message)
-    if not user_id:
-        return await message.reply("Please reply to a message or provide a username.")
+@command("mute", admin=True, bot_right="can_restrict_members", target=True, protect_admins="mute")
+async def mute(client: Client, message: Message, ctx: CommandContext):
+    user_id = ctx.target_id
 
-    # Parse duration
+    # Parse duration: bare seconds, or a number with a unit as in /massmute
     duration = 3600  # Default duration: 1 hour
     if len(message.command) > 2:
-        try:
-            duration = int(message.command[2])
-        except ValueError:
-            return await message.reply("Invalid duration. Please provide a number in seconds.")
+        token = message.command[2]
+        duration = int(token) if token.isdigit() else parse_duration(token)
+        if duration is None:
+            return await message.reply("Invalid duration. Please provide seconds, or a unit as in 30m, 12h or 7d.")
+    if not valid_duration(duration):
+        return await message.reply(INVALID_DURATION)
 
     try:
-        # Check if target user is an admin
-        target_member = await client.get_chat_member(message.chat.id, user_id)
-        if target_member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]:
-            return await message.reply("Cannot mute an admin.")
-
         # Calculate until_date as a datetime object
         until_date = datetime.fromtimestamp(time.time() + duration)
 
@@ -173,16 +128,20 @@ async def mute(client: Client, message: Message):
             until_date=until_date
         )
 
+        # Remember the mute so it can be listed and its expiry logged; the user is muted either way
+        try:
+            await restriction_scheduler.add(message.chat.id, user_id, message.from_user.id, MUTE, until_date)
+        except Exception as e:
+            logger.error(f"Error recording mute of {user_id} in {message.chat.id}: {e}")
+
         # Log the action
-        async for db in get_db():
-            await log_action(
-                client, 
-                db, 
-                message.chat.id, 
-                user_id, 
-                message.from_user.id, 
-                f"mute for {duration} seconds"
-            )
+        await log_action(
+            client,
+            message.chat.id,
+            user_id,
+            message.from_user.id,
+            f"mute for {duration} seconds"
+        )
 
         await message.reply(f"User muted for {duration} seconds.")
     except UserAdminInvalid:
@@ -190,30 +149,15 @@ async def mute(client: Client, message: Message):
     except ChatAdminRequired:
         await message.reply("I need admin rights to perform this action.")
     except FloodWait as e:
-        await asyncio.sleep(e.value)
         await message.reply(f"Rate limited. Please try again in {e.value} seconds.")
     except Exception as e:
         await message.reply(f"Error: {str(e)}")
     return None
 
 @Client.on_message(filters.command("unmute") & filters.group)
-async def unmute(client: Client, message: Message):
-    # Check if user is admin or owner
-    if not await is_admin(client, message.chat.id, message.from_user.id) and not await is_owner(message):
-        return await message.reply("You need to be an admin to use this command.")
-
-    # Check cooldown
-    if not await check_cooldown(message.from_user.id, "unmute"):
-        return await message.reply("Please wait before using this command again.")
-
-    # Check if bot is admin
-    if not await bot_is_admin(client, message.chat.id):
-        return await message.reply("I need admin rights.")
-
-    # Get target user
-    user_id = await get_target_user(client, message)
-    if not user_id:
-        return await message.reply("Please reply to a message or provide a username.")
+@command("unmute", admin=True, bot_right="can_restrict_members", target=True)
+async def unmute(client: Client, message: Message, ctx: CommandContext):
+    user_id = ctx.target_id
 
     try:
         # Unmute the user by giving back all permissions
@@ -231,61 +175,47 @@ async def unmute(client: Client, message: Message):
         )
 
         # Log the action
-        async for db in get_db():
-            await log_action(
-                client, 
-                db, 
-                message.chat.id, 
-                user_id, 
-                message.from_user.id, 
-                "unmute"
-            )
+        await log_action(
+            client,
+            message.chat.id,
+            user_id,
+            message.from_user.id,
+            "unmute"
+        )
 
-        await message.reply("User unmuted.")
+        # Drop the recorded mute, if the bot applied one
+        until_date = await restriction_scheduler.remove(message.chat.id, user_id, MUTE)
+        if until_date and until_date > datetime.now(timezone.utc):
+            await message.reply(f"User unmuted. The mute would have ended at {until_date:%Y-%m-%d %H:%M} UTC.")
+        else:
+            await message.reply("User unmuted.")
     except UserAdminInvalid:
         await message.reply("Cannot unmute this user; they may be an admin.")
     except ChatAdminRequired:
         await message.reply("I need admin rights to perform this action.")
     except FloodWait as e:
-        await asyncio.sleep(e.value)
         await message.reply(f"Rate limited. Please try again in {e.value} seconds.")
     except Exception as e:
         await message.reply(f"Error: {str(e)}")
     return None
 
 @Client.on_message(filters.command("unban") & filters.group)
-async def unban(client: Client, message: Message):
-    # Check if user is admin or owner
-    if not await is_admin(client, message.chat.id, message.from_user.id) and not await is_owner(message):
-        return await message.reply("You need to be an admin to use this command.")
-
-    # Check cooldown
-    if not await check_cooldown(message.from_user.id, "unban"):
-        return await message.reply("Please wait before using this command again.")
-
-    # Check if bot is admin
-    if not await bot_is_admin(client, message.chat.id):
-        return await message.reply("I need admin rights.")
-
-    # Get target user
-    user_id = await get_target_user(client, message)
-    if not user_id:
-        return await message.reply("Please reply to a message or provide a username.")
+@command("unban", admin=True, bot_right="can_restrict_members", target=True)
+async def unban(client: Client, message: Message, ctx: CommandContext):
+    user_id = ctx.target_id
 
     try:
         # Unban the user
         await client.unban_chat_member(message.chat.id, user_id)
 
         # Log the action
-        async for db in get_db():
-            await log_action(
-                client, 
-                db, 
-                message.chat.id, 
-                user_id, 
-                message.from_user.id, 
-                "unban"
-            )
+        await log_action(
+            client,
+            message.chat.id,
+            user_id,
+            message.from_user.id,
+            "unban"
+        )
 
         await message.reply("User unbanned.")
     except UserAdminInvalid:
@@ -293,30 +223,15 @@ async def unban(client: Client, message: Message):
     except ChatAdminRequired:
         await message.reply("I need admin rights to perform this action.")
     except FloodWait as e:
-        await asyncio.sleep(e.value)
         await message.reply(f"Rate limited. Please try again in {e.value} seconds.")
     except Exception as e:
         await message.reply(f"Error: {str(e)}")
     return None
 
 @Client.on_message(filters.command("warn") & filters.group)
-async def warn(client: Client, message: Message):
-    # Check if user is admin or owner
-    if not await is_admin(client, message.chat.id, message.from_user.id) and not await is_owner(message):
-        return await message.reply("You need to be an admin to use this command.")
-
-    # Check cooldown
-    if not await check_cooldown(message.from_user.id, "warn"):
-        return await message.reply("Please wait before using this command again.")
-
-    # Check if bot is admin
-    if not await bot_is_admin(client, message.chat.id):
-        return await message.reply("I need admin rights.")
-
-    # Get target user
-    user_id = await get_target_user(client, message)
-    if not user_id:
-        return await message.reply("Please reply to a message or provide a username.")
+@command("warn", admin=True, bot_right=ANY_RIGHTS, target=True, protect_admins="warn")
+async def warn(client: Client, message: Message, ctx: CommandContext):
+    user_id = ctx.target_id
 
     # Get reason (if provided)
     reason = None
@@ -324,166 +239,93 @@ async def warn(client: Client, message: Message):
         reason = " ".join(message.command[2:])
 
     try:
-        # Check if target user is an admin
-        target_member = await client.get_chat_member(message.chat.id, user_id)
-        if target_member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]:
-            return await message.reply("Cannot warn an admin.")
+        # Get group config for warn limit
+        group_config = await get_group_config(message.chat.id)
 
-        # Add warning to database
-        async for db in get_db():
-            # Get group config for warn limit
-            group_config = await db.execute(
-                select(GroupConfig).where(GroupConfig.group_id == message.chat.id)
-            )
-            group_config = group_config.scalar_one_or_none()
+        # Default warn limit is 3 if no config exists
+        warn_limit = 3
+        if group_config:
+            warn_limit = group_config.warn_limit
 
-            # Default warn limit is 3 if no config exists
-            warn_limit = 3
-            if group_config:
-                warn_limit = group_config.warn_limit
+        # Add the warning and get the new count in one round trip
+        warning_count = await add_warning(message.chat.id, user_id, message.from_user.id, reason)
 
-            # Add warning
-            warning = Warning(
-                group_id=message.chat.id,
-                user_id=user_id,
-                admin_id=message.from_user.id,
-                reason=reason
-            )
-            db.add(warning)
-            await db.commit()
+        # Log the action
+        await log_action(
+            client,
+            message.chat.id,
+            user_id,
+            message.from_user.id,
+            f"warn ({warning_count}/{warn_limit})" + (f": {reason}" if reason else "")
+        )
 
-            # Count warnings
-            warnings = await db.execute(
-                select(Warning).where(
-                    Warning.group_id == message.chat.id,
-                    Warning.user_id == user_id
-                )
-            )
-            warnings = warnings.scalars().all()
-            warning_count = len(warnings)
+        # Check if user should be banned
+        if warning_count >= warn_limit:
+            # Ban the user
+            await client.ban_chat_member(message.chat.id, user_id)
 
-            # Log the action
+            # Log the ban
             await log_action(
-                client, 
-                db, 
-                message.chat.id, 
-                user_id, 
-                message.from_user.id, 
-                f"warn ({warning_count}/{warn_limit})" + (f": {reason}" if reason else "")
+                client,
+                message.chat.id,
+                user_id,
+                message.from_user.id,
+                f"auto-ban after {warning_count} warnings"
             )
 
-            # Check if user should be banned
-            if warning_count >= warn_limit:
-                # Ban the user
-                await client.ban_chat_member(message.chat.id, user_id)
-
-                # Log the ban
-                await log_action(
-                    client, 
-                    db, 
-                    message.chat.id, 
-                    user_id, 
-                    message.from_user.id, 
-                    f"auto-ban after {warning_count} warnings"
-                )
-
-                return await message.reply(f"User has reached {warning_count}/{warn_limit} warnings and has been banned.")
-
-            # Reply with warning count
-            return await message.reply(f"User warned ({warning_count}/{warn_limit})." + (f" Reason: {reason}" if reason else ""))
+            return await message.reply(f"User has reached {warning_count}/{warn_limit} warnings and has been banned.")
+
+        # Reply with warning count
+        return await message.reply(f"User warned ({warning_count}/{warn_limit})." + (f" Reason: {reason}" if reason else ""))
     except UserAdminInvalid:
         await message.reply("Cannot warn this user; they may be an admin.")
     except ChatAdminRequired:
         await message.reply("I need admin rights to perform this action.")
     except FloodWait as e:
-        await asyncio.sleep(e.value)
         await message.reply(f"Rate limited. Please try again in {e.value} seconds.")
     except Exception as e:
         await message.reply(f"Error: {str(e)}")
     return None
 
 @Client.on_message(filters.command("unwarn") & filters.group)
-async def unwarn(client: Client, message: Message):
-    # Check if user is admin or owner
-    if not await is_admin(client, message.chat.id, message.from_user.id) and not await is_owner(message):
-        return await message.reply("You need to be an admin to use this command.")
-
-    # Check cooldown
-    if not await check_cooldown(message.from_user.id, "unwarn"):
-        return await message.reply("Please wait before using this command again.")
-
-    # Get target user
-    user_id = await get_target_user(client, message)
-    if not user_id:
-        return await message.reply("Please reply to a message or provide a username.")
+@command("unwarn", admin=True, target=True)
+async def unwarn(client: Client, message: Message, ctx: CommandContext):
+    user_id = ctx.target_id
 
     try:
-        # Remove the most recent warning
-        async for db in get_db():
-            # Get the most recent warning
-            warning = await db.execute(
-                select(Warning).where(
-                    Warning.group_id == message.chat.id,
-                    Warning.user_id == user_id
-                ).order_by(Warning.created_at.desc())
-            )
-            warning = warning.scalar_one_or_none()
-
-            if not warning:
-                return await message.reply("This user has no warnings to remove.")
+        # Remove the most recent warning and get the remaining count in one round trip
+        warning_count = await remove_latest_warning(message.chat.id, user_id)
 
-            # Delete the warning
-            await db.delete(warning)
-            await db.commit()
+        if warning_count is None:
+            return await message.reply("This user has no warnings to remove.")
 
-            # Count remaining warnings
-            warnings = await db.execute(
-                select(Warning).where(
-                    Warning.group_id == message.chat.id,
-                    Warning.user_id == user_id
-                )
-            )
-            warnings = warnings.scalars().all()
-            warning_count = len(warnings)
-
-            # Log the action
-            await log_action(
-                client, 
-                db, 
-                message.chat.id, 
-                user_id, 
-                message.from_user.id, 
-                f"unwarn (remaining: {warning_count})"
-            )
+        # Log the action
+        await log_action(
+            client,
+            message.chat.id,
+            user_id,
+            message.from_user.id,
+            f"unwarn (remaining: {warning_count})"
+        )
 
-            # Reply with warning count
-            return await message.reply(f"Warning removed. User now has {warning_count} warnings.")
+        # Reply with warning count
+        return await message.reply(f"Warning removed. User now has {warning_count} warnings.")
     except FloodWait as e:
-        await asyncio.sleep(e.value)
         await message.reply(f"Rate limited. Please try again in {e.value} seconds.")
     except Exception as e:
         await message.reply(f"Error: {str(e)}")
     return None
 
 @Client.on_message(filters.command("warnings") & filters.group)
-async def warnings(client: Client, message: Message):
-    # Check cooldown
-    if not await check_cooldown(message.from_user.id, "warnings"):
-        return await message.reply("Please wait before using this command again.")
-
-    # Get target user
-    user_id = await get_target_user(client, message)
-    if not user_id:
-        return await message.reply("Please reply to a message or provide a username.")
+@command("warnings", target=True)
+async def warnings(client: Client, message: Message, ctx: CommandContext):
+    user_id = ctx.target_id
 
     try:
         # Get user's warnings
         async for db in get_db():
             # Get group config for warn limit
-            group_config = await db.execute(
-                select(GroupConfig).where(GroupConfig.group_id == message.chat.id)
-            )
-            group_config = group_config.scalar_one_or_none()
+            group_config = await get_group_config(message.chat.id)
 
             # Default warn limit is 3 if no config exists
             warn_limit = 3
@@ -503,20 +345,139 @@ async def warnings(client: Client, message: Message):
             if warning_count == 0:
                 return await message.reply("This user has no warnings.")
 
+            # Resolve the user and every warning admin in one batch
+            users = await peer_cache.get_users(client, [user_id] + [warning.admin_id for warning in warnings])
+
             # Format warnings
-            user = await client.get_users(user_id)
+            user = users[user_id]
             warning_list = f"**Warnings for {user.first_name}** ({warning_count}/{warn_limit}):\n\n"
 
             for i, warning in enumerate(warnings, 1):
-                admin = await client.get_users(warning.admin_id)
+                admin = users[warning.admin_id]
                 warning_time = warning.created_at.strftime("%Y-%m-%d %H:%M:%S")
                 reason = f": {warning.reason}" if warning.reason else ""
                 warning_list += f"{i}. By {admin.first_name} on {warning_time}{reason}\n"
 
             return await message.reply(warning_list)
     except FloodWait as e:
-        await asyncio.sleep(e.value)
         await message.reply(f"Rate limited. Please try again in {e.value} seconds.")
     except Exception as e:
         await message.reply(f"Error: {str(e)}")
     return None
+
+
+async def run_mass_action(
+    client: Client, message: Message, verb: str, action: str, apply, targets, unrecognized, on_done=None
+):
+    """
+    Apply `apply(user_id)` to many targets, editing one status message as it goes,
+    and log everything that was done in one batch. `on_done`, if given, is
+    awaited with the ids of all users acted on.
+    """
+    if not targets:
+        return await message.reply(
+            f"Please list users to {verb} as @usernames or ids, or reply to a message listing them."
+        )
+    if len(targets) > BULK_MAX_TARGETS:
+        return await message.reply(f"At most {BULK_MAX_TARGETS} users can be handled at once.")
+
+    # One roster lookup protects every admin in the list
+    admins = await get_chat_admins(client, message.chat.id)
+    bot_id = await get_bot_id(client)
+
+    status = await message.reply(f"{verb.capitalize()}: 0/{len(targets)}…")
+    if unrecognized:
+        await message.reply(f"Ignored: {', '.join(unrecognized[:20])}")
+
+    async def act(target) -> int:
+        user_id = target if isinstance(target, int) else (await peer_cache.get_user(client, target)).id
+        if user_id in admins or user_id == bot_id:
+            raise Skip("admin")
+        await apply(user_id)
+        return user_id
+
+    async def progress(result):
+        # Progress edits come out of the chat's message budget, never ahead of the bans themselves
+        with outbound_priority(Priority.LOW):
+            await status.edit_text(
+                f"{verb.capitalize()}: {result.finished}/{result.total}"
+                f" ({len(result.skipped)} skipped, {len(result.failed)} failed)…"
+            )
+
+    result = await run_bulk(targets, act, on_progress=progress)
+
+    await log_actions([
+        (message.chat.id, user_id, message.from_user.id, action) for user_id in result.done
+    ])
+    if on_done is not None and result.done:
+        await on_done(result.done)
+    await status.edit_text(summarize(verb, result))
+    return None
+
+@Client.on_message(filters.command("massban") & filters.group)
+@command("massban", admin=True, bot_right="can_restrict_members")
+async def mass_ban(client: Client, message: Message, ctx: CommandContext):
+    targets, unrecognized, _ = parse_targets(message)
+
+    async def apply(user_id: int):
+        await client.ban_chat_member(message.chat.id, user_id)
+
+    try:
+        return await run_mass_action(client, message, "ban", "ban", apply, targets, unrecognized)
+    except Exception as e:
+        await message.reply(f"Error: {str(e)}")
+    return None
+
+@Client.on_message(filters.command("masskick") & filters.group)
+@command("masskick", admin=True, bot_right="can_restrict_members")
+async def mass_kick(client: Client, message: Message, ctx: CommandContext):
+    targets, unrecognized, _ = parse_targets(message)
+
+    async def apply(user_id: int):
+        await client.ban_chat_member(message.chat.id, user_id)
+        await client.unban_chat_member(message.chat.id, user_id)
+
+    try:
+        return await run_mass_action(client, message, "kick", "kick", apply, targets, unrecognized)
+    except Exception as e:
+        await message.reply(f"Error: {str(e)}")
+    return None
+
+@Client.on_message(filters.command("massmute") & filters.group)
+@command("massmute", admin=True, bot_right="can_restrict_members")
+async def mass_mute(client: Client, message: Message, ctx: CommandContext):
+    targets, unrecognized, duration = parse_targets(message, with_duration=True)
+    # Bare numbers are user ids here, so "/massmute @a @b 3600" is ambiguous
+    if duration is None and len(message.command) > 1 and message.command[-1].isdigit():
+        return await message.reply(
+            "Give the duration a unit, as in 3600s or 1h. To end the list with a user id, add the duration after it."
+        )
+    duration = duration or 3600  # Default duration: 1 hour
+    if not valid_duration(duration):
+        return await message.reply(INVALID_DURATION)
+    until_date = datetime.fromtimestamp(time.time() + duration)
+
+    async def apply(user_id: int):
+        await client.restrict_chat_member(
+            message.chat.id,
+            user_id,
+            permissions=ChatPermissions(),
+            until_date=until_date
+        )
+
+    async def record(user_ids):
+        # The users are muted either way, so a failure here must not hide the summary
+        try:
+            await restriction_scheduler.add_many([
+                (message.chat.id, user_id, message.from_user.id, MUTE, until_date) for user_id in user_ids
+            ])
+        except Exception as e:
+            logger.error(f"Error recording {len(user_ids)} mutes in {message.chat.id}: {e}")
+
+    try:
+        return await run_mass_action(
+            client, message, "mute", f"mute for {duration} seconds", apply, targets, unrecognized, on_done=record
+        )
+    except Exception as e:
+        await message.reply(f"Error: {str(e)}")
+    return None
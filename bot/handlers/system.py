@@ -1,12 +1,37 @@
 from pyrogram import Client, filters
 from pyrogram.enums import ChatMemberStatus
 from pyrogram.types import Message, ChatMemberUpdated
-from sqlalchemy.future import select
-
-from bot.utils import log_action, check_cooldown, is_admin, is_owner
-from database.connection import get_db
-from database.models import GroupConfig
 
+from bot.cache import peer_cache
+from bot.greetings import greetings
+from bot.pipeline import CommandContext, command
+from bot.restrictions import MUTE, restriction_scheduler
+from bot.state import broadcast_invalidation
+from bot.templates import (
+    DEFAULT_GOODBYE_TEMPLATE, DEFAULT_WELCOME_TEMPLATE, TemplateError, compile_template, get_template,
+    placeholder_help, remember_template
+)
+from bot.utils import (
+    log_action, get_bot_id, update_admin_cache, update_bot_rights, get_group_config, save_group_config,
+    ADMIN_STATUSES
+)
+
+
+@Client.on_message(group=-1)
+async def remember_message_peers(client: Client, message: Message):
+    # Feed the peer cache from users and chats already attached to updates
+    peer_cache.remember_user(message.from_user)
+    peer_cache.remember_chat(message.chat)
+    if message.reply_to_message:
+        peer_cache.remember_user(message.reply_to_message.from_user)
+
+@Client.on_chat_member_updated(group=-1)
+async def remember_member_peers(client: Client, chat_member: ChatMemberUpdated):
+    peer_cache.remember_chat(chat_member.chat)
+    peer_cache.remember_user(chat_member.from_user)
+    for member in (chat_member.old_chat_member, chat_member.new_chat_member):
+        if member:
+            peer_cache.remember_user(member.user)
 
 @Client.on_message(filters.command("ping"))
 async def ping(client: Client, message: Message):
@@ -22,6 +47,22 @@ async def handle_member_update(client: Client, chat_member: ChatMemberUpdated):
     old_status = chat_member.old_chat_member.status if chat_member.old_chat_member else None
     new_status = chat_member.new_chat_member.status if chat_member.new_chat_member else None
 
+    # Keep the cached admin roster in sync with promotions and demotions
+    if old_status != new_status and (old_status in ADMIN_STATUSES or new_status in ADMIN_STATUSES):
+        member = chat_member.new_chat_member or chat_member.old_chat_member
+        update_admin_cache(chat_member.chat.id, member.user.id, new_status)
+        await broadcast_invalidation("admins", chat_member.chat.id)
+
+    # A mute lifted by hand in Telegram is no longer active; one that leaves or is banned keeps it on rejoining
+    if old_status == ChatMemberStatus.RESTRICTED and \
+       new_status in (ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR):
+        await restriction_scheduler.remove(chat_member.chat.id, chat_member.old_chat_member.user.id, MUTE)
+
+    # Refresh the bot's own rights whenever its membership changes
+    if chat_member.new_chat_member and chat_member.new_chat_member.user.id == await get_bot_id(client):
+        update_bot_rights(chat_member.chat.id, chat_member.new_chat_member)
+        await broadcast_invalidation("bot_rights", chat_member.chat.id)
+
     # User joined the group
     if (old_status is None or old_status == ChatMemberStatus.LEFT or old_status == ChatMemberStatus.BANNED) and \
        (new_status == ChatMemberStatus.MEMBER or new_status == ChatMemberStatus.ADMINISTRATOR or new_status == ChatMemberStatus.OWNER):
@@ -35,140 +76,79 @@ async def handle_member_update(client: Client, chat_member: ChatMemberUpdated):
 async def handle_user_join(client: Client, chat_member: ChatMemberUpdated):
     try:
         # Get group config
-        async for db in get_db():
-            group_config = await db.execute(
-                select(GroupConfig).where(GroupConfig.group_id == chat_member.chat.id)
-            )
-            group_config = group_config.scalar_one_or_none()
-
-            # If no config or no welcome message, use default
-            welcome_message = "Welcome to the group, {user}!"
-            if group_config and group_config.welcome_message:
-                welcome_message = group_config.welcome_message
-
-            # Format the message
-            user = chat_member.new_chat_member.user
-            formatted_message = welcome_message.format(
-                user=user.mention,
-                first_name=user.first_name,
-                last_name=user.last_name or "",
-                username=f"@{user.username}" if user.username else "",
-                group=chat_member.chat.title
-            )
-
-            # Send the welcome message
-            await client.send_message(chat_member.chat.id, formatted_message)
-
-            # Log the action
-            await log_action(
-                client,
-                db,
-                chat_member.chat.id,
-                user.id,
-                0,  # No admin for this action
-                "joined the group"
-            )
+        group_config = await get_group_config(chat_member.chat.id)
+
+        # If no config or no welcome message, use default; templates are compiled once
+        welcome_message = get_template(group_config.welcome_message if group_config else None, DEFAULT_WELCOME_TEMPLATE)
+
+        # Send the welcome message and log the join; joins during a raid are batched
+        await greetings.add(
+            client,
+            chat_member.chat,
+            "join",
+            chat_member.new_chat_member.user,
+            "joined the group",
+            welcome_message
+        )
     except Exception as e:
         print(f"Error in handle_user_join: {e}")
 
 async def handle_user_leave(client: Client, chat_member: ChatMemberUpdated):
     try:
         # Get group config
-        async for db in get_db():
-            group_config = await db.execute(
-                select(GroupConfig).where(GroupConfig.group_id == chat_member.chat.id)
-            )
-            group_config = group_config.scalar_one_or_none()
-
-            # If no config or no goodbye message, use default
-            goodbye_message = "Goodbye, {user}!"
-            if group_config and group_config.goodbye_message:
-                goodbye_message = group_config.goodbye_message
-
-            # Format the message
-            user = chat_member.old_chat_member.user
-            formatted_message = goodbye_message.format(
-                user=user.mention,
-                first_name=user.first_name,
-                last_name=user.last_name or "",
-                username=f"@{user.username}" if user.username else "",
-                group=chat_member.chat.title
-            )
-
-            # Send the goodbye message
-            await client.send_message(chat_member.chat.id, formatted_message)
-
-            # Log the action
-            action = "left the group"
-            if chat_member.new_chat_member and chat_member.new_chat_member.status == ChatMemberStatus.BANNED:
-                action = "was banned from the group"
-
-            await log_action(
-                client,
-                db,
-                chat_member.chat.id,
-                user.id,
-                0,  # No admin for this action
-                action
-            )
+        group_config = await get_group_config(chat_member.chat.id)
+
+        # If no config or no goodbye message, use default; templates are compiled once
+        goodbye_message = get_template(group_config.goodbye_message if group_config else None, DEFAULT_GOODBYE_TEMPLATE)
+
+        action = "left the group"
+        if chat_member.new_chat_member and chat_member.new_chat_member.status == ChatMemberStatus.BANNED:
+            action = "was banned from the group"
+
+        # Send the goodbye message and log the leave; leaves during a raid are batched
+        await greetings.add(
+            client,
+            chat_member.chat,
+            "leave",
+            chat_member.old_chat_member.user,
+            action,
+            goodbye_message
+        )
     except Exception as e:
         print(f"Error in handle_user_leave: {e}")
 
 @Client.on_message(filters.command("setwelcome") & filters.group)
-async def set_welcome(client: Client, message: Message):
-    # Check if user is admin or owner
-    if not await is_admin(client, message.chat.id, message.from_user.id) and not await is_owner(message):
-        return await message.reply("You need to be an admin to use this command.")
-
-    # Check cooldown
-    if not await check_cooldown(message.from_user.id, "setwelcome"):
-        return await message.reply("Please wait before using this command again.")
-
+@command("setwelcome", admin=True)
+async def set_welcome(client: Client, message: Message, ctx: CommandContext):
     # Get welcome message
     if len(message.command) < 2:
         return await message.reply(
-            "Please provide a welcome message. You can use the following placeholders:\n"
-            "{user} - User mention\n"
-            "{first_name} - User's first name\n"
-            "{last_name} - User's last name\n"
-            "{username} - User's username\n"
-            "{group} - Group name"
+            "Please provide a welcome message. You can use the following placeholders:\n" + placeholder_help()
         )
 
     welcome_message = " ".join(message.command[1:])
 
+    # Reject malformed templates now rather than when someone joins
+    try:
+        template = compile_template(welcome_message)
+    except TemplateError as e:
+        return await message.reply(f"{e}\nYou can use the following placeholders:\n" + placeholder_help())
+
     try:
         # Update group config
-        async for db in get_db():
-            # Get or create group config
-            group_config = await db.execute(
-                select(GroupConfig).where(GroupConfig.group_id == message.chat.id)
-            )
-            group_config = group_config.scalar_one_or_none()
-
-            if group_config:
-                group_config.welcome_message = welcome_message
-            else:
-                group_config = GroupConfig(
-                    group_id=message.chat.id,
-                    welcome_message=welcome_message
-                )
-                db.add(group_config)
-
-            await db.commit()
-
-            # Log the action
-            await log_action(
-                client,
-                db,
-                message.chat.id,
-                message.from_user.id,
-                message.from_user.id,
-                "set welcome message"
-            )
-
-            await message.reply("Welcome message set successfully.")
-            return None
+        await save_group_config(message.chat.id, welcome_message=welcome_message)
+        remember_template(template)
+
+        # Log the action
+        await log_action(
+            client,
+            message.chat.id,
+            message.from_user.id,
+            message.from_user.id,
+            "set welcome message"
+        )
+
+        await message.reply("Welcome message set successfully.")
         return None
     except Exception as e:
         await message.reply(f"Error: {str(e)}")
@@ -176,72 +156,43 @@ async def set_welcome(client: Client, message: Message):
 
 
 @Client.on_message(filters.command("setgoodbye") & filters.group)
-async def set_goodbye(client: Client, message: Message):
-    # Check if user is admin or owner
-    if not await is_admin(client, message.chat.id, message.from_user.id) and not await is_owner(message):
-        return await message.reply("You need to be an admin to use this command.")
-
-    # Check cooldown
-    if not await check_cooldown(message.from_user.id, "setgoodbye"):
-        return await message.reply("Please wait before using this command again.")
-
+@command("setgoodbye", admin=True)
+async def set_goodbye(client: Client, message: Message, ctx: CommandContext):
     # Get goodbye message
     if len(message.command) < 2:
         return await message.reply(
-            "Please provide a goodbye message. You can use the following placeholders:\n"
-            "{user} - User mention\n"
-            "{first_name} - User's first name\n"
-            "{last_name} - User's last name\n"
-            "{username} - User's username\n"
-            "{group} - Group name"
+            "Please provide a goodbye message. You can use the following placeholders:\n" + placeholder_help()
         )
 
     goodbye_message = " ".join(message.command[1:])
 
+    # Reject malformed templates now rather than when someone joins
+    try:
+        template = compile_template(goodbye_message)
+    except TemplateError as e:
+        return await message.reply(f"{e}\nYou can use the following placeholders:\n" + placeholder_help())
+
     try:
         # Update group config
-        async for db in get_db():
-            # Get or create group config
-            group_config = await db.execute(
-                select(GroupConfig).where(GroupConfig.group_id == message.chat.id)
-            )
-            group_config = group_config.scalar_one_or_none()
-
-            if group_config:
-                group_config.goodbye_message = goodbye_message
-            else:
-                group_config = GroupConfig(
-                    group_id=message.chat.id,
-                    goodbye_message=goodbye_message
-                )
-                db.add(group_config)
-
-            await db.commit()
-
-            # Log the action
-            await log_action(
-                client,
-                db,
-                message.chat.id,
-                message.from_user.id,
-                message.from_user.id,
-                "set goodbye message"
-            )
-
-            await message.reply("Goodbye message set successfully.")
+        await save_group_config(message.chat.id, goodbye_message=goodbye_message)
+        remember_template(template)
+
+        # Log the action
+        await log_action(
+            client,
+            message.chat.id,
+            message.from_user.id,
+            message.from_user.id,
+            "set goodbye message"
+        )
+
+        await message.reply("Goodbye message set successfully.")
     except Exception as e:
         await message.reply(f"Error: {str(e)}")
 
 @Client.on_message(filters.command("setwarnlimit") & filters.group)
-async def set_warn_limit(client: Client, message: Message):
-    # Check if user is admin or owner
-    if not await is_admin(client, message.chat.id, message.from_user.id) and not await is_owner(message):
-        return await message.reply("You need to be an admin to use this command.")
-
-    # Check cooldown
-    if not await check_cooldown(message.from_user.id, "setwarnlimit"):
-        return await message.reply("Please wait before using this command again.")
-
+@command("setwarnlimit", admin=True)
+async def set_warn_limit(client: Client, message: Message, ctx: CommandContext):
     # Get warn limit
     if len(message.command) < 2:
         return await message.reply("Please provide a warn limit (number of warnings before ban).")
@@ -255,69 +206,38 @@ async def set_warn_limit(client: Client, message: Message):
 
     try:
         # Update group config
-        async for db in get_db():
-            # Get or create group config
-            group_config = await db.execute(
-                select(GroupConfig).where(GroupConfig.group_id == message.chat.id)
-            )
-            group_config = group_config.scalar_one_or_none()
-
-            if group_config:
-                group_config.warn_limit = warn_limit
-            else:
-                group_config = GroupConfig(
-                    group_id=message.chat.id,
-                    warn_limit=warn_limit
-                )
-                db.add(group_config)
-
-            await db.commit()
-
-            # Log the action
-            await log_action(
-                client,
-                db,
-                message.chat.id,
-                message.from_user.id,
-                message.from_user.id,
-                f"set warn limit to {warn_limit}"
-            )
-
-            await message.reply(f"Warn limit set to {warn_limit}.")
+        await save_group_config(message.chat.id, warn_limit=warn_limit)
+
+        # Log the action
+        await log_action(
+            client,
+            message.chat.id,
+            message.from_user.id,
+            message.from_user.id,
+            f"set warn limit to {warn_limit}"
+        )
+
+        await message.reply(f"Warn limit set to {warn_limit}.")
     except Exception as e:
         await message.reply(f"Error: {str(e)}")
 
 @Client.on_message(filters.command("rules") & filters.group)
-async def rules(client: Client, message: Message):
-    # Check cooldown
-    if not await check_cooldown(message.from_user.id, "rules"):
-        return await message.reply("Please wait before using this command again.")
-
+@command("rules")
+async def rules(client: Client, message: Message, ctx: CommandContext):
     try:
         # Get group config
-        async for db in get_db():
-            group_config = await db.execute(
-                select(GroupConfig).where(GroupConfig.group_id == message.chat.id)
-            )
-            group_config = group_config.scalar_one_or_none()
+        group_config = await get_group_config(message.chat.id)
 
-            if not group_config or not group_config.rules:
-                return await message.reply("No rules have been set for this group.")
+        if not group_config or not group_config.rules:
+            return await message.reply("No rules have been set for this group.")
 
-            await message.reply(f"**Group Rules:**\n\n{group_config.rules}")
+        await message.reply(f"**Group Rules:**\n\n{group_config.rules}")
     except Exception as e:
         await message.reply(f"Error: {str(e)}")
 
 @Client.on_message(filters.command("setrules") & filters.group)
-async def set_rules(client: Client, message: Message):
-    # Check if user is admin or owner
-    if not await is_admin(client, message.chat.id, message.from_user.id) and not await is_owner(message):
-        return await message.reply("You need to be an admin to use this command.")
-
-    # Check cooldown
-    if not await check_cooldown(message.from_user.id, "setrules"):
-        return await message.reply("Please wait before using this command again.")
-
+@command("setrules", admin=True)
+async def set_rules(client: Client, message: Message, ctx: CommandContext):
     # Get rules
     if len(message.command) < 2:
         return await message.reply("Please provide the rules for the group.")
@@ -326,36 +246,18 @@ async def set_rules(client: Client, message: Message):
 
     try:
         # Update group config
-        async for db in get_db():
-            # Get or create group config
-            group_config = await db.execute(
-                select(GroupConfig).where(GroupConfig.group_id == message.chat.id)
-            )
-            group_config = group_config.scalar_one_or_none()
-
-            if group_config:
-                group_config.rules = rules_text
-            else:
-                group_config = GroupConfig(
-                    group_id=message.chat.id,
-                    rules=rules_text
-                )
-                db.add(group_config)
-
-            await db.commit()
-
-            # Log the action
-            await log_action(
-                client,
-                db,
-                message.chat.id,
-                message.from_user.id,
-                message.from_user.id,
-                "set group rules"
-            )
-
-            await message.reply("Group rules set successfully.")
-            return None
+        await save_group_config(message.chat.id, rules=rules_text)
+
+        # Log the action
+        await log_action(
+            client,
+            message.chat.id,
+            message.from_user.id,
+            message.from_user.id,
+            "set group rules"
+        )
+
+        await message.reply("Group rules set successfully.")
         return None
     except Exception as e:
         await message.reply(f"Error: {str(e)}")
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pyrogram import Client
+
+from bot.cache import peer_cache
+from bot.scheduler import Priority, outbound_priority
+from database.rollups import action_type
+
+logger = logging.getLogger(__name__)
+
+# Owner digest configuration
+OWNER_DIGEST_WINDOW = float(os.getenv("OWNER_DIGEST_WINDOW", 30))
+OWNER_DIGEST_SEND_INTERVAL = float(os.getenv("OWNER_DIGEST_SEND_INTERVAL", 1.5))
+OWNER_DIGEST_MAX_EVENTS = int(os.getenv("OWNER_DIGEST_MAX_EVENTS", 10000))
+
+# Telegram rejects text messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+
+def split_message(lines: List[str], limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """
+    Pack lines into as few messages as possible without exceeding the length limit.
+    """
+    chunks = []
+    current = ""
+    for line in lines:
+        if len(line) > limit:
+            line = line[:limit - 1] + "…"
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            candidate = line
+        current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class OwnerNotifier:
+    """
+    Collects moderation actions and sends them to the owner as periodic digests,
+    grouped by group and action type. Callers only enqueue; a background task
+    resolves names, renders the digest and paces the sends.
+    """
+
+    def __init__(self, window: float, send_interval: float, max_events: int):
+        self.window = window
+        self.send_interval = send_interval
+        self.max_events = max_events
+        self._events: List[Tuple[datetime, int, int, int, str]] = []
+        self._client: Optional[Client] = None
+        self._task: Optional[asyncio.Task] = None
+        self.dropped_events = 0
+        self.sent_messages = 0
+
+    def enqueue(self, group_id: int, user_id: int, admin_id: int, action: str):
+        if len(self._events) >= self.max_events:
+            self.dropped_events += 1
+            return
+        self._events.append((datetime.now(), group_id, user_id, admin_id, action))
+
+    async def start(self, client: Client):
+        self._client = client
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the background task and send whatever is still pending.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.window)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error sending owner digest: {e}")
+
+    async def flush(self):
+        events, self._events = self._events, []
+        owner_id = int(os.getenv("OWNER_ID", 0))
+        if not events or not owner_id or self._client is None:
+            return
+
+        chats, users = await self._resolve_names(events)
+        for index, text in enumerate(split_message(self.render(events, chats, users))):
+            if index:
+                await asyncio.sleep(self.send_interval)
+            await self._send(owner_id, text)
+
+    async def _resolve_names(self, events) -> Tuple[Dict[int, str], Dict[int, str]]:
+        # Names come from the peer cache; only unknown peers cost a round trip
+        chats = {}
+        for group_id in {event[1] for event in events}:
+            try:
+                chats[group_id] = (await peer_cache.get_chat(self._client, group_id)).title
+            except Exception:
+                pass
+
+        users = {}
+        user_ids = {uid for event in events for uid in event[2:4] if uid}
+        try:
+            resolved = await peer_cache.get_users(self._client, user_ids)
+            users = {user_id: user.first_name for user_id, user in resolved.items()}
+        except Exception:
+            pass
+        return chats, users
+
+    @staticmethod
+    def render(events, chats: Dict[int, str], users: Dict[int, str]) -> List[str]:
+        """
+        Render events as digest lines, grouped by group and then by action type.
+        """
+        grouped: "OrderedDict[int, OrderedDict[str, list]]" = OrderedDict()
+        for event in events:
+            grouped.setdefault(event[1], OrderedDict()).setdefault(action_type(event[4]), []).append(event)
+
+        start, end = events[0][0], events[-1][0]
+        lines = [
+            "🛡 **Moderation Digest** 🛡",
+            f"{len(events)} actions from {start.strftime('%Y-%m-%d %H:%M:%S')} to {end.strftime('%H:%M:%S')}",
+        ]
+        for group_id, by_type in grouped.items():
+            lines.append("")
+            lines.append(f"**Group:** {chats.get(group_id, 'Unknown')} (`{group_id}`)")
+            for kind, items in by_type.items():
+                lines.append(f"__{kind}__ × {len(items)}")
+                for created_at, _, user_id, admin_id, action in items:
+                    line = f"• {created_at.strftime('%H:%M:%S')} {users.get(user_id, 'User')} (`{user_id}`)"
+                    if admin_id:
+                        line += f" by {users.get(admin_id, 'Admin')} (`{admin_id}`)"
+                    lines.append(f"{line}: {action}")
+        return lines
+
+    async def _send(self, owner_id: int, text: str):
+        # FloodWaits are retried by the outbound scheduler
+        try:
+            with outbound_priority(Priority.LOW):
+                await self._client.send_message(owner_id, text)
+            self.sent_messages += 1
+        except Exception as e:
+            logger.error(f"Error sending log to owner: {e}")
+
+
+owner_notifier = OwnerNotifier(
+    window=OWNER_DIGEST_WINDOW,
+    send_interval=OWNER_DIGEST_SEND_INTERVAL,
+    max_events=OWNER_DIGEST_MAX_EVENTS,
+)
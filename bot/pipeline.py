@@ -0,0 +1,157 @@
+import asyncio
+import functools
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pyrogram import Client
+from pyrogram.types import Message
+
+from bot.utils import bot_can, bot_is_admin, cached_is_admin, check_cooldown, get_target_user, is_admin, is_owner
+from metrics import COMMAND_SECONDS
+from profiling import span
+
+# Pass as bot_right to require any admin rights rather than a specific one
+ANY_RIGHTS = "any"
+
+# Reply when the bot lacks the right a command needs, worded as the handlers always replied
+BOT_RIGHT_MESSAGES = {
+    ANY_RIGHTS: "I need admin rights.",
+    "can_restrict_members": "I need admin rights to restrict members.",
+}
+
+
+class CommandContext:
+    """
+    What the pipeline found out before the handler runs.
+    """
+
+    __slots__ = ("command", "is_owner", "target_id")
+
+    def __init__(self, command: str, is_owner: bool):
+        self.command = command
+        self.is_owner = is_owner
+        self.target_id: Optional[int] = None
+
+
+class StageTimings:
+    """
+    Count, total and maximum seconds per (command, stage), also exported
+    as a histogram.
+    """
+
+    def __init__(self):
+        self._timings: Dict[str, Dict[str, List[float]]] = defaultdict(dict)
+
+    def record(self, command: str, stage: str, seconds: float):
+        COMMAND_SECONDS.labels(command, stage).observe(seconds)
+        entry = self._timings[command].get(stage)
+        if entry is None:
+            self._timings[command][stage] = [1, seconds, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def stats(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        return {
+            command: {
+                stage: {"count": count, "avg_seconds": total / count, "max_seconds": longest}
+                for stage, (count, total, longest) in stages.items()
+            }
+            for command, stages in self._timings.items()
+        }
+
+
+stage_timings = StageTimings()
+
+
+async def _target_is_admin(client: Client, chat_id: int, target) -> bool:
+    target_id = await target
+    return target_id is not None and await is_admin(client, chat_id, target_id)
+
+
+def command(
+    name: str,
+    admin: bool = False,
+    bot_right: Optional[str] = None,
+    target: bool = False,
+    protect_admins: Optional[str] = None,
+):
+    """
+    Run the usual checks before a command handler, in three stages:
+
+    - caller: whether the caller is the owner, then the cooldown. When the
+      chat's admin roster is cached, a non-admin is told they need to be an
+      admin before the cooldown and never uses up a token. Otherwise the
+      cooldown goes first and only an allowed command looks the caller up,
+      so a flood of commands cannot each cost a Telegram round trip;
+    - checks: the bot's rights and the target user (and whether the target
+      is an admin), looked up concurrently;
+    - handler: the command itself, called as handler(client, message, ctx).
+
+    `admin` requires the caller to be an admin or the owner, `bot_right` names
+    a right the bot must hold (or ANY_RIGHTS), `target` requires a target user,
+    and `protect_admins` is the verb for "Cannot <verb> an admin." when admins
+    may not be targeted. Each stage's duration is recorded per command.
+    """
+    def decorator(handler: Callable[[Client, Message, CommandContext], Awaitable[Any]]):
+        @functools.wraps(handler)
+        async def wrapper(client: Client, message: Message):
+            chat_id, user_id = message.chat.id, message.from_user.id
+            started = time.perf_counter()
+
+            # Stage 1: the caller; None means the roster is not cached and is only loaded past the cooldown
+            with span("caller checks"):
+                ctx = CommandContext(name, await is_owner(message))
+                caller_admin = not admin or ctx.is_owner or cached_is_admin(chat_id, user_id)
+                allowed = caller_admin is not False and await check_cooldown(chat_id, user_id, name)
+                if allowed and caller_admin is None:
+                    caller_admin = await is_admin(client, chat_id, user_id)
+            checked_caller = time.perf_counter()
+            stage_timings.record(name, "caller", checked_caller - started)
+            if caller_admin is False:
+                return await message.reply("You need to be an admin to use this command.")
+            if not allowed:
+                return await message.reply("Please wait before using this command again.")
+
+            # Stage 2: independent lookups, concurrently
+            lookups = {}
+            if bot_right == ANY_RIGHTS:
+                lookups["bot_right"] = bot_is_admin(client, chat_id)
+            elif bot_right:
+                lookups["bot_right"] = bot_can(client, chat_id, bot_right)
+            if target or protect_admins:
+                target_task = asyncio.ensure_future(get_target_user(client, message))
+                lookups["target"] = target_task
+                if protect_admins:
+                    lookups["target_admin"] = _target_is_admin(client, chat_id, target_task)
+
+            with span("checks"):
+                results = dict(zip(lookups, await asyncio.gather(*lookups.values(), return_exceptions=True)))
+            stage_timings.record(name, "checks", time.perf_counter() - checked_caller)
+
+            # Report failures in the order the handlers always checked them
+            if bot_right and results["bot_right"] is not True:
+                return await message.reply(BOT_RIGHT_MESSAGES.get(bot_right, "I need admin rights."))
+            if "target" in results:
+                if isinstance(results["target"], Exception):
+                    return await message.reply(f"Error: {str(results['target'])}")
+                ctx.target_id = results["target"]
+                if not ctx.target_id:
+                    return await message.reply("Please reply to a message or provide a username.")
+            if protect_admins and results["target_admin"] is True:
+                return await message.reply(f"Cannot {protect_admins} an admin.")
+
+            # Stage 3: the command itself
+            handler_started = time.perf_counter()
+            try:
+                with span(name):
+                    return await handler(client, message, ctx)
+            finally:
+                finished = time.perf_counter()
+                stage_timings.record(name, "handler", finished - handler_started)
+                stage_timings.record(name, "total", finished - started)
+
+        return wrapper
+    return decorator
@@ -0,0 +1,136 @@
+import os
+import time
+from collections import Counter
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+# Default limit: 1 command per 2 seconds
+DEFAULT_COMMAND_LIMIT = os.getenv("DEFAULT_COMMAND_LIMIT", "1/2")
+# Per-command overrides, e.g. "ban=5/60,rules=1/10"
+COMMAND_RATE_LIMITS = os.getenv("COMMAND_RATE_LIMITS", "")
+
+# (capacity, period): up to `capacity` uses, refilled continuously over `period` seconds
+Limit = Tuple[float, float]
+
+
+def parse_limit(spec: str) -> Limit:
+    """
+    Parse a limit written as "uses/seconds", e.g. "5/60".
+    """
+    uses, _, seconds = spec.partition("/")
+    capacity, period = float(uses), float(seconds or 1)
+    if capacity < 1 or period <= 0:
+        raise ValueError(f"Invalid rate limit: {spec!r}")
+    return capacity, period
+
+
+def parse_limits(spec: str) -> Dict[str, Limit]:
+    """
+    Parse per-command limits written as "command=uses/seconds,...".
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        command, _, limit = item.partition("=")
+        limits[command.strip().lstrip("/")] = parse_limit(limit.strip())
+    return limits
+
+
+class CommandLimits:
+    """
+    Per-command limits, with counters of allowed and denied uses.
+    """
+
+    def __init__(self, default: Limit, limits: Optional[Dict[str, Limit]] = None):
+        self.default = default
+        self.limits = limits or {}
+        self.allowed: Counter = Counter()
+        self.denied: Counter = Counter()
+
+    def limit_for(self, command: str) -> Limit:
+        return self.limits.get(command, self.default)
+
+    def record(self, command: str, allowed: bool):
+        if allowed:
+            self.allowed[command] += 1
+        else:
+            self.denied[command] += 1
+
+    def stats(self) -> Dict[str, object]:
+        return {"allowed": dict(self.allowed), "denied": dict(self.denied)}
+
+
+class TokenBucketLimiter:
+    """
+    Token buckets keyed by e.g. (chat, user, command). A bucket is dropped
+    once it has refilled completely, since it is then identical to a fresh
+    one; a timer wheel finds those buckets so memory stays bounded by active
+    users.
+    """
+
+    def __init__(self, resolution: float = 1.0, slots: int = 512):
+        self.resolution = resolution
+        # key -> [tokens, updated_at, full_at]
+        self._buckets: Dict[Hashable, List[float]] = {}
+        self._wheel: List[Set[Hashable]] = [set() for _ in range(slots)]
+        self._tick = int(time.monotonic() / resolution)
+        self.evicted = 0
+
+    def take(self, key: Hashable, limit: Limit, now: Optional[float] = None) -> bool:
+        """
+        Take one token from the key's bucket; returns False if none is left.
+        """
+        now = time.monotonic() if now is None else now
+        self._advance(now)
+
+        capacity, period = limit
+        rate = capacity / period
+        bucket = self._buckets.get(key)
+        tokens = capacity if bucket is None else min(capacity, bucket[0] + (now - bucket[1]) * rate)
+
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+
+        full_at = now + (capacity - tokens) / rate
+        self._buckets[key] = [tokens, now, full_at]
+        self._schedule(key, full_at)
+        return allowed
+
+    def _schedule(self, key: Hashable, at: float, after_tick: Optional[int] = None):
+        tick = max(int(at / self.resolution), (self._tick if after_tick is None else after_tick) + 1)
+        self._wheel[tick % len(self._wheel)].add(key)
+
+    def _advance(self, now: float):
+        target = int(now / self.resolution)
+        # After a long idle period every slot is due; visiting each once is enough
+        first = max(self._tick + 1, target - len(self._wheel) + 1)
+        for tick in range(first, target + 1):
+            slot = self._wheel[tick % len(self._wheel)]
+            if not slot:
+                continue
+            due, slot_keys = [], list(slot)
+            slot.clear()
+            for key in slot_keys:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    continue
+                if bucket[2] <= now:
+                    due.append(key)
+                else:
+                    # Touched since it was scheduled, or beyond the wheel's horizon
+                    self._schedule(key, bucket[2], after_tick=tick)
+            for key in due:
+                del self._buckets[key]
+            self.evicted += len(due)
+        self._tick = max(self._tick, target)
+
+    def stats(self) -> Dict[str, object]:
+        return {"active_buckets": len(self._buckets), "evicted": self.evicted}
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+command_limits = CommandLimits(
+    default=parse_limit(DEFAULT_COMMAND_LIMIT),
+    limits=parse_limits(COMMAND_RATE_LIMITS),
+)
@@ -0,0 +1,242 @@
+import asyncio
+import heapq
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.future import select
+
+from bot.utils import log_actions
+from database.connection import SessionLocal
+from database.models import ActiveRestriction
+
+logger = logging.getLogger(__name__)
+
+# Expiries this many seconds apart are handled together
+RESTRICTION_EXPIRY_BATCH_WINDOW = float(os.getenv("RESTRICTION_EXPIRY_BATCH_WINDOW", 1.0))
+
+MUTE = "mute"
+
+# Telegram makes a restriction ending under 30 seconds or over 366 days from now permanent; the
+# lower bound leaves room for the call to wait in the outbound scheduler
+MIN_RESTRICTION_SECONDS = 60
+MAX_RESTRICTION_SECONDS = 366 * 86400
+
+# (group_id, user_id, kind)
+Key = Tuple[int, int, str]
+
+
+def _utc(moment: Optional[datetime]) -> Optional[datetime]:
+    # Naive datetimes are local time, as produced by datetime.fromtimestamp
+    if moment is None:
+        return None
+    return datetime.fromtimestamp(moment.timestamp(), timezone.utc)
+
+
+class RestrictionScheduler:
+    """
+    Keeps active_restrictions in step with the restrictions the bot applies,
+    and handles their expiry. Telegram lifts a mute by itself at its
+    until_date; the scheduler removes the row and logs the expiry. Pending
+    expiries live in a min-heap loaded in bulk at startup, and expiries
+    within the batch window are deleted and logged together.
+    """
+
+    def __init__(self, batch_window: float):
+        self.batch_window = batch_window
+        # (until timestamp, key); entries superseded in _until are skipped when popped
+        self._heap: List[Tuple[float, Key]] = []
+        self._until: Dict[Key, float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters exposed through stats()
+        self.expired = 0
+        self.expiry_batches = 0
+
+    async def start(self):
+        if self._task is not None:
+            return
+        await self.load()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def load(self):
+        """
+        Load every timed restriction into the heap with one query.
+        """
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(
+                    ActiveRestriction.group_id, ActiveRestriction.user_id,
+                    ActiveRestriction.kind, ActiveRestriction.until_date
+                ).where(ActiveRestriction.until_date.is_not(None))
+            )
+            rows = result.all()
+        self._until = {(group_id, user_id, kind): until.timestamp() for group_id, user_id, kind, until in rows}
+        self._heap = [(until, key) for key, until in self._until.items()]
+        heapq.heapify(self._heap)
+        logger.info(f"Loaded {len(self._heap)} active restrictions")
+
+    def _push(self, key: Key, until: Optional[datetime]):
+        if until is None:
+            self._until.pop(key, None)
+            return
+        timestamp = until.timestamp()
+        self._until[key] = timestamp
+        heapq.heappush(self._heap, (timestamp, key))
+        if self._wakeup is not None and self._heap[0][1] == key:
+            self._wakeup.set()
+
+    async def add_many(self, entries: List[Tuple[int, int, int, str, Optional[datetime]]]):
+        """
+        Record (group_id, user_id, admin_id, kind, until_date) restrictions,
+        replacing any earlier restriction of the same kind.
+        """
+        if not entries:
+            return
+        values = [
+            {"group_id": group_id, "user_id": user_id, "admin_id": admin_id, "kind": kind, "until_date": _utc(until)}
+            for group_id, user_id, admin_id, kind, until in entries
+        ]
+        statement = pg_insert(ActiveRestriction).values(values)
+        async with SessionLocal() as db:
+            await db.execute(statement.on_conflict_do_update(
+                index_elements=[ActiveRestriction.group_id, ActiveRestriction.user_id, ActiveRestriction.kind],
+                set_={
+                    "admin_id": statement.excluded.admin_id,
+                    "until_date": statement.excluded.until_date,
+                    "created_at": statement.excluded.created_at,
+                }
+            ))
+            await db.commit()
+        for group_id, user_id, _, kind, until in entries:
+            self._push((group_id, user_id, kind), until)
+
+    async def add(self, group_id: int, user_id: int, admin_id: int, kind: str, until: Optional[datetime]):
+        await self.add_many([(group_id, user_id, admin_id, kind, until)])
+
+    async def get(self, group_id: int, user_id: int, kind: str = MUTE) -> Optional[ActiveRestriction]:
+        """
+        Look up a user's current restriction by primary key.
+        """
+        async with SessionLocal() as db:
+            restriction = await db.get(ActiveRestriction, (group_id, user_id, kind))
+        if restriction is not None and restriction.until_date is not None \
+                and restriction.until_date <= datetime.now(timezone.utc):
+            # Expired, and about to be removed by the scheduler
+            return None
+        return restriction
+
+    async def remove(self, group_id: int, user_id: int, kind: str = MUTE) -> Optional[datetime]:
+        """
+        Forget a restriction lifted before its end. Returns the until_date it
+        had, or None if there was no such restriction.
+        """
+        async with SessionLocal() as db:
+            result = await db.execute(
+                delete(ActiveRestriction).where(
+                    ActiveRestriction.group_id == group_id,
+                    ActiveRestriction.user_id == user_id,
+                    ActiveRestriction.kind == kind,
+                ).returning(ActiveRestriction.until_date)
+            )
+            until = result.scalar_one_or_none()
+            await db.commit()
+        # The heap entry is skipped when it comes up
+        self._until.pop((group_id, user_id, kind), None)
+        return until
+
+    async def _run(self):
+        while True:
+            try:
+                delay = self._next_delay()
+                if delay is None or delay > 0:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                due = self._pop_due()
+                try:
+                    await self._expire([key for _, key in due])
+                except Exception:
+                    # Try the batch again after the pause below rather than forget it until a restart
+                    self._requeue(due)
+                    raise
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error expiring restrictions: {e}")
+                await asyncio.sleep(self.batch_window)
+
+    def _next_delay(self) -> Optional[float]:
+        # Drop superseded entries so the head is always live
+        while self._heap and self._until.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        # Wait out the batch window after the first expiry so neighbours join its batch
+        return self._heap[0][0] + self.batch_window - time.time()
+
+    def _pop_due(self) -> List[Tuple[float, Key]]:
+        now = time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            until, key = heapq.heappop(self._heap)
+            if self._until.get(key) == until:
+                del self._until[key]
+                due.append((until, key))
+        return due
+
+    def _requeue(self, due: List[Tuple[float, Key]]):
+        for until, key in due:
+            # Unless the restriction was renewed or removed meanwhile
+            if key not in self._until:
+                self._until[key] = until
+                heapq.heappush(self._heap, (until, key))
+
+    async def _expire(self, keys: List[Key]):
+        if not keys:
+            return
+        async with SessionLocal() as db:
+            # Rows renewed by another worker in the meantime are left alone
+            result = await db.execute(
+                delete(ActiveRestriction).where(and_(
+                    tuple_(ActiveRestriction.group_id, ActiveRestriction.user_id, ActiveRestriction.kind).in_(keys),
+                    ActiveRestriction.until_date <= datetime.now(timezone.utc),
+                )).returning(ActiveRestriction.group_id, ActiveRestriction.user_id, ActiveRestriction.kind)
+            )
+            expired = result.all()
+            await db.commit()
+
+        self.expired += len(expired)
+        self.expiry_batches += 1
+        await log_actions([
+            (group_id, user_id, 0, f"un{kind} (expired)") for group_id, user_id, kind in expired
+        ])
+
+    def stats(self):
+        return {
+            "scheduled": len(self._until),
+            "heap_size": len(self._heap),
+            "expired": self.expired,
+            "expiry_batches": self.expiry_batches,
+        }
+
+
+restriction_scheduler = RestrictionScheduler(batch_window=RESTRICTION_EXPIRY_BATCH_WINDOW)
@@ -0,0 +1,434 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+from pyrogram.session import Session
+
+from bot.cache import TTLCache
+from bot.ratelimit import Limit, parse_limit
+from metrics import (
+    FLOOD_WAIT_SECONDS, FLOOD_WAITS, TELEGRAM_QUEUE_SECONDS, TELEGRAM_REQUEST_SECONDS, TELEGRAM_REQUESTS,
+    method_label,
+)
+from profiling import span, traced
+
+logger = logging.getLogger(__name__)
+
+# Outbound request budgets, as uses/seconds
+OUTBOUND_GLOBAL_LIMIT = os.getenv("OUTBOUND_GLOBAL_LIMIT", "30/1")
+OUTBOUND_CHAT_LIMIT = os.getenv("OUTBOUND_CHAT_LIMIT", "20/60")
+# Bans, restrictions and deletions in one chat have their own budget, so chatter cannot hold them back
+OUTBOUND_MODERATION_LIMIT = os.getenv("OUTBOUND_MODERATION_LIMIT", "20/1")
+# Maximum chats whose budget is tracked; an evicted chat starts with a full budget
+OUTBOUND_CHAT_BUDGETS_SIZE = int(os.getenv("OUTBOUND_CHAT_BUDGETS_SIZE", 10000))
+# FloodWaits are retried this many times, and only if the wait is at most this many seconds
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", 3))
+OUTBOUND_MAX_FLOOD_WAIT = float(os.getenv("OUTBOUND_MAX_FLOOD_WAIT", 300))
+
+
+class Priority(IntEnum):
+    # Restrictions and deletions go first
+    HIGH = 0
+    # Replies, lookups and everything not classified otherwise
+    NORMAL = 1
+    # Welcome and goodbye messages, owner digests
+    LOW = 2
+
+
+# Raw methods that enforce moderation decisions
+HIGH_PRIORITY_METHODS = frozenset({
+    "functions.channels.EditBanned",
+    "functions.channels.DeleteMessages",
+    "functions.channels.DeleteParticipantHistory",
+    "functions.messages.DeleteMessages",
+    "functions.messages.DeleteChatUser",
+    "functions.messages.EditChatDefaultBannedRights",
+})
+
+# Connection housekeeping is never queued behind the bot's own traffic
+UNSCHEDULED_PREFIXES = ("functions.auth.", "functions.help.", "functions.updates.")
+
+_priority: ContextVar[Optional[Priority]] = ContextVar("outbound_priority", default=None)
+
+
+@contextmanager
+def outbound_priority(priority: Priority):
+    """
+    Send every Telegram call made inside the block with the given priority.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def request_priority(method: str) -> Priority:
+    """
+    Priority of a raw method called now: the outbound_priority() block it is
+    called in, or HIGH for moderation and NORMAL for everything else.
+    """
+    priority = _priority.get()
+    if priority is None:
+        priority = Priority.HIGH if method in HIGH_PRIORITY_METHODS else Priority.NORMAL
+    return priority
+
+
+def peer_key(query) -> Optional[int]:
+    """
+    Return the id of the chat a raw query targets, or None if it has none.
+    """
+    for name in ("peer", "channel"):
+        peer = getattr(query, name, None)
+        for attribute in ("channel_id", "chat_id", "user_id"):
+            value = getattr(peer, attribute, None)
+            if value is not None:
+                return value
+    return None
+
+
+class Budget:
+    """
+    Token bucket that reports how long until the next token is available, and
+    that can be blocked outright until a FloodWait expires.
+    """
+
+    def __init__(self, limit: Limit, now: float):
+        self.capacity, period = limit
+        self.rate = self.capacity / period
+        self.tokens = self.capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> float:
+        return min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+
+    def delay(self, now: float) -> float:
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        tokens = self._refill(now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def consume(self, now: float):
+        self.tokens = self._refill(now) - 1
+        self.updated = now
+
+    def block(self, until: float):
+        self.blocked_until = max(self.blocked_until, until)
+
+    def idle_seconds(self, now: float) -> float:
+        # Until this bucket is indistinguishable from a fresh one
+        return max(self.blocked_until - now, (self.capacity - self.tokens) / self.rate)
+
+
+class Request:
+    __slots__ = ("call", "method", "chat", "priority", "seq", "future", "queued_at", "attempts")
+
+    def __init__(self, call, method: str, chat: Optional[int], priority: Priority, seq: int):
+        self.call = call
+        self.method = method
+        self.chat = chat
+        self.priority = priority
+        self.seq = seq
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.monotonic()
+        self.attempts = 0
+
+    def __lt__(self, other: "Request") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundScheduler:
+    """
+    Queues outbound Telegram calls and starts them in priority order within a
+    global budget and per-chat budgets for writes: one for moderation calls
+    and one for everything else the bot sends. A FloodWait does not park
+    the caller's handler in a sleep: the call is deferred until the wait is over,
+    the chat (or, for calls without one, the method) is held back meanwhile, and
+    the caller only sees the FloodWait once the retries are used up.
+    """
+
+    def __init__(self, global_limit: Limit, chat_limit: Limit, moderation_limit: Limit, chat_budgets_size: int,
+                 max_retries: int, max_flood_wait: float):
+        self.chat_limit = chat_limit
+        self.moderation_limit = moderation_limit
+        self.max_retries = max_retries
+        self.max_flood_wait = max_flood_wait
+        self.global_budget = Budget(global_limit, time.monotonic())
+        self._chat_budgets = TTLCache(maxsize=chat_budgets_size, ttl=chat_limit[1])
+        # method -> monotonic time its FloodWait ends
+        self._method_blocks: Dict[str, float] = {}
+        # Requests that may start now, by priority; and requests waiting for a time
+        self._ready: List[Request] = []
+        self._deferred: List[Tuple[float, Request]] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
+
+        # Counters exposed through stats()
+        self.dispatched = 0
+        self.flood_waits = 0
+        self.retries = 0
+        self.failed = 0
+        self._waits: Dict[Priority, List[float]] = {priority: [0, 0.0, 0.0] for priority in Priority}
+
+    async def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Nothing will start the remaining requests any more
+        for request in self._ready + [request for _, request in self._deferred]:
+            if not request.future.done():
+                request.future.set_exception(ConnectionError("Outbound scheduler stopped"))
+        self._ready.clear()
+        self._deferred.clear()
+
+    async def submit(self, call: Callable[[], Awaitable[Any]], method: str,
+                     chat: Optional[int] = None, priority: Priority = Priority.NORMAL) -> Any:
+        """
+        Queue `call` and return its result once it has been sent.
+        """
+        if self._task is None:
+            return await call()
+        request = Request(call, method, chat, priority, next(self._seq))
+        heapq.heappush(self._ready, request)
+        self._wakeup.set()
+        return await request.future
+
+    def _budget_key(self, request: Request) -> Optional[Tuple[Hashable, Limit]]:
+        """
+        The key and limit of the per-chat budget a request draws from, or None if it has none.
+        """
+        if request.chat is None or _is_read(request.method):
+            return None
+        if request.method in HIGH_PRIORITY_METHODS:
+            return ("moderation", request.chat), self.moderation_limit
+        return request.chat, self.chat_limit
+
+    def _chat_budget(self, request: Request, now: float) -> Optional[Budget]:
+        found = self._budget_key(request)
+        if found is None:
+            return None
+        key, limit = found
+        budget = self._chat_budgets.get(key)
+        if budget is None:
+            budget = Budget(limit, now)
+            self._chat_budgets.set(key, budget, ttl=limit[1])
+        return budget
+
+    def _save_budget(self, request: Request, budget: Budget, now: float):
+        key, _ = self._budget_key(request)
+        self._chat_budgets.set(key, budget, ttl=budget.idle_seconds(now))
+
+    def _defer(self, request: Request, until: float):
+        heapq.heappush(self._deferred, (until, request))
+
+    async def _run(self):
+        while True:
+            delay = self._dispatch(time.monotonic())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self, now: float) -> Optional[float]:
+        """
+        Start every request the budgets allow; returns the seconds until
+        another one could start, or None if that depends on a new request.
+        """
+        while self._deferred and self._deferred[0][0] <= now:
+            heapq.heappush(self._ready, heapq.heappop(self._deferred)[1])
+
+        delay = None
+        while self._ready:
+            delay = self.global_budget.delay(now)
+            if delay > 0:
+                break
+            delay = None
+            request = heapq.heappop(self._ready)
+            if request.future.done():
+                # The caller gave up waiting
+                continue
+
+            wait = self._method_blocks.get(request.method, 0.0) - now
+            budget = self._chat_budget(request, now)
+            if budget is not None:
+                wait = max(wait, budget.delay(now))
+            if wait > 0:
+                self._defer(request, now + wait)
+                continue
+
+            self.global_budget.consume(now)
+            if budget is not None:
+                budget.consume(now)
+                self._save_budget(request, budget, now)
+            self._record_wait(request, now)
+            task = asyncio.create_task(self._execute(request))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+        if self._deferred:
+            until_deferred = self._deferred[0][0] - now
+            delay = until_deferred if delay is None else min(delay, until_deferred)
+        return delay
+
+    def _record_wait(self, request: Request, now: float):
+        self.dispatched += 1
+        if request.attempts:
+            return
+        wait = now - request.queued_at
+        TELEGRAM_QUEUE_SECONDS.labels(request.priority.name.lower()).observe(wait)
+        stats = self._waits[request.priority]
+        stats[0] += 1
+        stats[1] += wait
+        stats[2] = max(stats[2], wait)
+
+    async def _execute(self, request: Request):
+        try:
+            result = await request.call()
+        except FloodWait as e:
+            self._flood_wait(request, e)
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            if not request.future.done():
+                request.future.set_result(result)
+
+    def _flood_wait(self, request: Request, error: FloodWait):
+        self.flood_waits += 1
+        now = time.monotonic()
+        until = now + error.value
+        budget = self._chat_budget(request, now)
+        if budget is not None:
+            budget.block(until)
+            self._save_budget(request, budget, now)
+        else:
+            self._method_blocks[request.method] = max(self._method_blocks.get(request.method, 0.0), until)
+        for method in [m for m, blocked_until in self._method_blocks.items() if blocked_until <= now]:
+            del self._method_blocks[method]
+
+        if request.attempts >= self.max_retries or error.value > self.max_flood_wait:
+            logger.warning(f"Giving up on {request.method} after FloodWait of {error.value}s")
+            self.failed += 1
+            if not request.future.done():
+                request.future.set_exception(error)
+            return
+
+        request.attempts += 1
+        self.retries += 1
+        self._defer(request, until)
+        self._wakeup.set()
+
+    def depth(self) -> int:
+        return len(self._ready) + len(self._deferred)
+
+    def stats(self) -> Dict[str, Any]:
+        queued = {priority.name.lower(): 0 for priority in Priority}
+        for request in self._ready:
+            queued[request.priority.name.lower()] += 1
+        return {
+            "queued": queued,
+            "deferred": len(self._deferred),
+            "in_flight": len(self._in_flight),
+            "dispatched": self.dispatched,
+            "flood_waits": self.flood_waits,
+            "retries": self.retries,
+            "failed": self.failed,
+            "blocked_methods": len(self._method_blocks),
+            "wait_seconds": {
+                priority.name.lower(): {
+                    "avg": total / count if count else 0.0,
+                    "max": longest,
+                }
+                for priority, (count, total, longest) in self._waits.items()
+            },
+        }
+
+
+def _is_read(method: str) -> bool:
+    # Per-chat limits apply to what the bot sends, not to lookups
+    return method.rsplit(".", 1)[-1].startswith("Get")
+
+
+outbound_scheduler = OutboundScheduler(
+    global_limit=parse_limit(OUTBOUND_GLOBAL_LIMIT),
+    chat_limit=parse_limit(OUTBOUND_CHAT_LIMIT),
+    moderation_limit=parse_limit(OUTBOUND_MODERATION_LIMIT),
+    chat_budgets_size=OUTBOUND_CHAT_BUDGETS_SIZE,
+    max_retries=OUTBOUND_MAX_RETRIES,
+    max_flood_wait=OUTBOUND_MAX_FLOOD_WAIT,
+)
+
+
+class ScheduledClient(Client):
+    """
+    Client whose raw API calls all go through the outbound scheduler, so the
+    high-level methods (send_message, ban_chat_member, ...) are scheduled too.
+    Every call is counted and timed by method.
+    """
+
+    async def invoke(
+        self,
+        query,
+        retries: int = Session.MAX_RETRIES,
+        timeout: float = Session.WAIT_TIMEOUT,
+        sleep_threshold: float = None
+    ):
+        method = query.QUALNAME
+        label = method_label(method)
+
+        async def call():
+            started = time.perf_counter()
+            outcome = "ok"
+            try:
+                return await super(ScheduledClient, self).invoke(query, retries, timeout, sleep_threshold)
+            except FloodWait as e:
+                outcome = "flood_wait"
+                FLOOD_WAITS.labels(label).inc()
+                FLOOD_WAIT_SECONDS.labels(label).inc(e.value)
+                raise
+            except Exception:
+                outcome = "error"
+                raise
+            finally:
+                TELEGRAM_REQUESTS.labels(label, outcome).inc()
+                TELEGRAM_REQUEST_SECONDS.labels(label).observe(time.perf_counter() - started)
+
+        if method.startswith(UNSCHEDULED_PREFIXES):
+            return await call()
+
+        priority = request_priority(method)
+        # Includes the time queued, which the span tree should show
+        with span(label):
+            return await outbound_scheduler.submit(call, method, chat=peer_key(query), priority=priority)
+
+
+# High-level methods shown in traces above the raw calls they make
+TRACED_CLIENT_METHODS = (
+    "get_chat", "get_chat_member", "get_users", "get_me",
+    "send_message", "edit_message_text", "delete_messages",
+    "ban_chat_member", "unban_chat_member", "restrict_chat_member",
+)
+for _name in TRACED_CLIENT_METHODS:
+    setattr(ScheduledClient, _name, traced(getattr(Client, _name)))
@@ -0,0 +1,265 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional
+
+from bot.ratelimit import TokenBucketLimiter
+
+logger = logging.getLogger(__name__)
+
+# Empty for in-process state, or a redis:// URL to share state between workers
+STATE_BACKEND_URL = os.getenv("STATE_BACKEND_URL", "")
+# Prefix for every key and channel, so several deployments can share one server
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "modbot:")
+# Timer wheel granularity in seconds and number of slots for in-process cooldowns
+COOLDOWN_WHEEL_RESOLUTION = float(os.getenv("COOLDOWN_WHEEL_RESOLUTION", 1.0))
+COOLDOWN_WHEEL_SLOTS = int(os.getenv("COOLDOWN_WHEEL_SLOTS", 512))
+
+# Channel carrying cache invalidations between workers
+INVALIDATION_CHANNEL = "invalidate"
+
+Subscriber = Callable[[str], None]
+
+
+class StateBackend(ABC):
+    """
+    State shared by every worker: rate-limit buckets, small values and
+    broadcast messages. Keys and channels are plain strings.
+    """
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def take_token(self, key: str, capacity: float, period: float) -> bool:
+        """
+        Take one token from a bucket holding up to `capacity` tokens that refills
+        over `period` seconds; returns False if none is left.
+        """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    async def publish(self, channel: str, message: str):
+        ...
+
+    @abstractmethod
+    def subscribe(self, channel: str, callback: Subscriber):
+        """
+        Call `callback` with every message published on `channel`, including
+        messages published by this worker.
+        """
+
+
+class MemoryBackend(StateBackend):
+    """
+    In-process backend: correct for a single worker, and the default.
+    """
+
+    def __init__(self, resolution: float = 1.0, slots: int = 512):
+        self.limiter = TokenBucketLimiter(resolution=resolution, slots=slots)
+        # key -> (expires_at or None, value)
+        self._values: Dict[str, Any] = {}
+        self._subscribers: Dict[str, List[Subscriber]] = {}
+
+    async def take_token(self, key: str, capacity: float, period: float) -> bool:
+        return self.limiter.take(key, (capacity, period))
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self._values[key] = (None if ttl is None else time.monotonic() + ttl, value)
+
+    async def delete(self, key: str):
+        self._values.pop(key, None)
+
+    async def publish(self, channel: str, message: str):
+        for callback in self._subscribers.get(channel, []):
+            callback(message)
+
+    def subscribe(self, channel: str, callback: Subscriber):
+        self._subscribers.setdefault(channel, []).append(callback)
+
+
+# Atomic token bucket: the hash holds the token count and the last refill time in
+# milliseconds, and expires once the bucket would be full again. The caller passes
+# the time, which keeps the script deterministic for replication.
+TAKE_TOKEN_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+local ts = tonumber(bucket[2])
+if tokens == nil or ts == nil then
+    tokens = capacity
+    ts = now
+end
+-- Workers' clocks may disagree slightly; never refill backwards
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate) + 1)
+return allowed
+"""
+
+
+class RedisBackend(StateBackend):
+    """
+    Backend for any server speaking the Redis protocol, shared by all workers.
+    Requires the `redis` package.
+    """
+
+    def __init__(self, url: str, prefix: str = ""):
+        # Imported here so in-process deployments do not need the package
+        from redis import asyncio as aioredis
+        from redis.exceptions import NoScriptError
+
+        self.prefix = prefix
+        self._redis = aioredis.from_url(url, decode_responses=True)
+        self._no_script_error = NoScriptError
+        self._take_token_sha: Optional[str] = None
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._subscribers: Dict[str, List[Subscriber]] = {}
+
+    async def start(self):
+        self._take_token_sha = await self._redis.script_load(TAKE_TOKEN_SCRIPT)
+        self._pubsub = self._redis.pubsub()
+        if self._subscribers:
+            await self._pubsub.subscribe(*(self.prefix + channel for channel in self._subscribers))
+        self._listener = asyncio.create_task(self._listen())
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        await self._redis.aclose()
+
+    async def _listen(self):
+        while True:
+            if not self._pubsub.subscribed:
+                await asyncio.sleep(0.1)
+                continue
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except Exception as e:
+                logger.error(f"Error reading from state backend: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if message is None:
+                continue
+            channel = message["channel"][len(self.prefix):]
+            for callback in self._subscribers.get(channel, []):
+                try:
+                    callback(message["data"])
+                except Exception as e:
+                    logger.error(f"Error handling message on {channel}: {e}")
+
+    async def take_token(self, key: str, capacity: float, period: float) -> bool:
+        rate = capacity / (period * 1000)
+        args = (capacity, rate, int(time.time() * 1000))
+        if self._take_token_sha is None:
+            self._take_token_sha = await self._redis.script_load(TAKE_TOKEN_SCRIPT)
+        try:
+            allowed = await self._redis.evalsha(self._take_token_sha, 1, self.prefix + key, *args)
+        except self._no_script_error:
+            # The server restarted or its script cache was flushed
+            self._take_token_sha = await self._redis.script_load(TAKE_TOKEN_SCRIPT)
+            allowed = await self._redis.evalsha(self._take_token_sha, 1, self.prefix + key, *args)
+        return bool(allowed)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._redis.get(self.prefix + key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        await self._redis.set(self.prefix + key, value, px=None if ttl is None else int(ttl * 1000))
+
+    async def delete(self, key: str):
+        await self._redis.delete(self.prefix + key)
+
+    async def publish(self, channel: str, message: str):
+        await self._redis.publish(self.prefix + channel, message)
+
+    def subscribe(self, channel: str, callback: Subscriber):
+        first = channel not in self._subscribers
+        self._subscribers.setdefault(channel, []).append(callback)
+        if first and self._pubsub is not None:
+            asyncio.ensure_future(self._pubsub.subscribe(self.prefix + channel))
+
+
+def create_backend(url: str) -> StateBackend:
+    if not url:
+        return MemoryBackend(resolution=COOLDOWN_WHEEL_RESOLUTION, slots=COOLDOWN_WHEEL_SLOTS)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url, prefix=STATE_KEY_PREFIX)
+    raise ValueError(f"Unsupported STATE_BACKEND_URL: {url}")
+
+
+state_backend = create_backend(STATE_BACKEND_URL)
+
+# Identifies this worker's own invalidation messages
+WORKER_ID = uuid.uuid4().hex
+
+
+async def broadcast_invalidation(cache: str, key: Any):
+    """
+    Tell the other workers to drop `key` from their copy of a named cache.
+    """
+    try:
+        await state_backend.publish(
+            INVALIDATION_CHANNEL,
+            json.dumps({"worker": WORKER_ID, "cache": cache, "key": key})
+        )
+    except Exception as e:
+        logger.error(f"Error broadcasting invalidation of {cache}: {e}")
+
+
+def on_invalidation(caches: Dict[str, Any]):
+    """
+    Subscribe the named local caches to invalidations from other workers.
+    """
+    def handle(message: str):
+        payload = json.loads(message)
+        if payload.get("worker") == WORKER_ID:
+            return
+        cache = caches.get(payload.get("cache"))
+        if cache is not None:
+            cache.pop(payload.get("key"))
+
+    state_backend.subscribe(INVALIDATION_CHANNEL, handle)
@@ -0,0 +1,114 @@
+import logging
+import os
+from string import Formatter
+from typing import Dict, Optional, Tuple
+
+from bot.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Maximum distinct compiled templates kept in memory
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", 10000))
+
+# Placeholders a welcome or goodbye message may use, with their help text
+TEMPLATE_FIELDS = {
+    "user": "User mention",
+    "first_name": "User's first name",
+    "last_name": "User's last name",
+    "username": "User's username",
+    "group": "Group name",
+}
+
+DEFAULT_WELCOME_TEMPLATE = "Welcome to the group, {user}!"
+DEFAULT_GOODBYE_TEMPLATE = "Goodbye, {user}!"
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class Template:
+    """
+    A parsed welcome or goodbye message: literal text alternating with field
+    names, so rendering is a single join with no parsing.
+    """
+
+    __slots__ = ("source", "literals", "fields")
+
+    def __init__(self, source: str, literals: Tuple[str, ...], fields: Tuple[str, ...]):
+        self.source = source
+        # literals[i] comes before fields[i]; the last literal ends the message
+        self.literals = literals
+        self.fields = fields
+
+    def render(self, values: Dict[str, str]) -> str:
+        parts = []
+        for literal, field in zip(self.literals, self.fields):
+            parts.append(literal)
+            parts.append(values[field])
+        parts.append(self.literals[-1])
+        return "".join(parts)
+
+
+def compile_template(source: str) -> Template:
+    """
+    Parse a template, rejecting anything but the plain placeholders in TEMPLATE_FIELDS.
+    Raises TemplateError with a message suitable for the admin who wrote it.
+    """
+    literals, fields = [], []
+    pending = ""
+    try:
+        parsed = list(Formatter().parse(source))
+    except ValueError as e:
+        raise TemplateError(f"Invalid template: {e}. Use {{{{ and }}}} for literal braces.")
+
+    for literal, field, format_spec, conversion in parsed:
+        pending += literal
+        if field is None:
+            continue
+        if field not in TEMPLATE_FIELDS:
+            raise TemplateError(f"Unknown placeholder {{{field}}}.")
+        if format_spec or conversion:
+            raise TemplateError(f"Placeholder {{{field}}} cannot have a format or conversion.")
+        literals.append(pending)
+        fields.append(field)
+        pending = ""
+    literals.append(pending)
+    return Template(source, tuple(literals), tuple(fields))
+
+
+# source -> Template, or None for stored templates that no longer compile
+compiled_templates = TTLCache(maxsize=TEMPLATE_CACHE_SIZE, ttl=float("inf"))
+_MISSING = object()
+
+
+def get_template(source: Optional[str], default: str) -> Template:
+    """
+    Return the compiled form of a stored template, compiling each distinct
+    template once. Falls back to `default` if the stored text is empty or was
+    saved before templates were validated and does not compile.
+    """
+    if not source:
+        source = default
+    template = compiled_templates.get(source, _MISSING)
+    if template is _MISSING:
+        try:
+            template = compile_template(source)
+        except TemplateError as e:
+            logger.warning(f"Ignoring invalid stored template {source!r}: {e}")
+            template = None
+        compiled_templates.set(source, template)
+    if template is None:
+        return get_template(default, default)
+    return template
+
+
+def remember_template(template: Template):
+    """
+    Cache a template compiled when it was saved.
+    """
+    compiled_templates.set(template.source, template)
+
+
+def placeholder_help() -> str:
+    return "\n".join(f"{{{name}}} - {description}" for name, description in TEMPLATE_FIELDS.items())
@@ -1,17 +1,44 @@
+import asyncio
 import os
-import time
-from datetime import datetime
-from typing import Dict, Tuple
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
 
 from pyrogram import Client
-from pyrogram.enums import ChatMemberStatus
+from pyrogram.enums import ChatMemberStatus, ChatMembersFilter
 from pyrogram.types import Message
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import delete, insert, literal, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.future import select
 
-from database.models import ModerationLog
+from bot.cache import admin_cache, bot_rights_cache, group_config_cache, peer_cache
+from bot.notifier import owner_notifier
+from bot.ratelimit import command_limits
+from bot.state import broadcast_invalidation, state_backend
+from database.connection import SessionLocal
+from database.models import GroupConfig, Warning, WarningCount
+from database.rollups import apply_warning_rollups
+from database.writer import log_writer
 
-# Command cooldown: user_id -> (command, timestamp)
-command_cooldowns: Dict[int, Tuple[str, float]] = {}
+ADMIN_STATUSES = (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+
+# Admin rights tracked for the bot itself; admins always hold can_manage_chat
+BOT_RIGHTS = (
+    "can_manage_chat",
+    "can_delete_messages",
+    "can_restrict_members",
+    "can_promote_members",
+    "can_change_info",
+    "can_invite_users",
+    "can_pin_messages",
+)
+
+# Distinguishes a cache miss from a cached "no config" entry
+_MISSING = object()
+
+# The bot's own user id, resolved once at startup
+bot_user_id: Optional[int] = None
+
+# Roster loads currently in flight: chat_id -> task
+_admin_loads: Dict[int, "asyncio.Task[Set[int]]"] = {}
 
 async def is_owner(message: Message):
     return message.from_user.id == int(os.getenv("OWNER_ID"))
@@ -20,34 +47,68 @@ async def get_target_user(client: Client, message: Message):
     if message.reply_to_message:
         return message.reply_to_message.from_user.id
     elif len(message.command) > 1:
-        return (await client.get_users(message.command[1])).id
+        return (await peer_cache.get_user(client, message.command[1])).id
     return None
 
-async def bot_is_admin(client: Client, chat_id):
-    me = await client.get_me()
-    member = await client.get_chat_member(chat_id, me.id)
-    return member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]
+async def get_bot_id(client: Client) -> int:
+    """
+    Get the bot's own user id, calling get_me only if it was not resolved at startup.
+    """
+    global bot_user_id
+    if bot_user_id is None:
+        me = getattr(client, "me", None) or await client.get_me()
+        bot_user_id = me.id
+    return bot_user_id
+
+def _member_rights(member) -> FrozenSet[str]:
+    if member is None or member.status not in ADMIN_STATUSES:
+        return frozenset()
+    if member.status == ChatMemberStatus.OWNER:
+        return frozenset(BOT_RIGHTS)
+
+    privileges = member.privileges
+    rights = {right for right in BOT_RIGHTS if privileges and getattr(privileges, right, False)}
+    rights.add("can_manage_chat")
+    return frozenset(rights)
 
-async def check_cooldown(user_id: int, command: str) -> bool:
+def update_bot_rights(chat_id: int, member):
     """
-    Check if a user is on cooldown for a command.
-    Returns True if the user can execute the command, False otherwise.
+    Store the bot's rights in a chat from one of its own ChatMember objects.
+    """
+    bot_rights_cache.set(chat_id, _member_rights(member))
+
+async def get_bot_rights(client: Client, chat_id: int) -> FrozenSet[str]:
+    """
+    Get the bot's admin rights in a chat, looking them up only on a cache miss.
     """
-    cooldown_time = 2.0  # 2 seconds cooldown
-    current_time = time.time()
+    rights = bot_rights_cache.get(chat_id)
+    if rights is None:
+        member = await client.get_chat_member(chat_id, await get_bot_id(client))
+        rights = _member_rights(member)
+        bot_rights_cache.set(chat_id, rights)
+    return rights
 
-    if user_id in command_cooldowns:
-        last_command, last_time = command_cooldowns[user_id]
-        if current_time - last_time < cooldown_time:
-            return False
+async def bot_is_admin(client: Client, chat_id):
+    return bool(await get_bot_rights(client, chat_id))
+
+async def bot_can(client: Client, chat_id: int, right: str) -> bool:
+    """
+    Check if the bot holds a specific admin right in a chat, e.g. "can_restrict_members".
+    """
+    return right in await get_bot_rights(client, chat_id)
 
-    # Update the cooldown
-    command_cooldowns[user_id] = (command, current_time)
-    return True
+async def check_cooldown(chat_id: int, user_id: int, command: str) -> bool:
+    """
+    Check if a user is on cooldown for a command in a chat.
+    Returns True if the user can execute the command, False otherwise.
+    """
+    capacity, period = command_limits.limit_for(command)
+    allowed = await state_backend.take_token(f"cooldown:{chat_id}:{user_id}:{command}", capacity, period)
+    command_limits.record(command, allowed)
+    return allowed
 
 async def log_action(
     client: Client,
-    db_session: AsyncSession,
     group_id: int,
     user_id: int,
     admin_id: int,
@@ -55,43 +116,198 @@ async def log_action(
 ):
     """
     Log a moderation action to the database and owner's private chat.
+    Both are queued and batched, so this never waits on a commit or a send.
     """
-    # Log to database
-    log_entry = ModerationLog(
-        group_id=group_id,
-        user_id=user_id,
-        admin_id=admin_id,
-        action=action
-    )
-    db_session.add(log_entry)
-    await db_session.commit()
+    # Queue the database row
+    log_writer.enqueue(group_id, user_id, admin_id, action)
 
-    # Log to owner's private chat
-    owner_id = int(os.getenv("OWNER_ID"))
-    try:
-        group = await client.get_chat(group_id)
-        user = await client.get_users(user_id)
-        admin = await client.get_users(admin_id)
-
-        log_message = (
-            f"🛡 **Moderation Action** 🛡\n"
-            f"**Group:** {group.title} (`{group_id}`)\n"
-            f"**User:** {user.first_name} (`{user_id}`)\n"
-            f"**Admin:** {admin.first_name} (`{admin_id}`)\n"
-            f"**Action:** {action}\n"
-            f"**Time:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        )
+    # Queue the owner notification; it is sent as part of a periodic digest
+    owner_notifier.enqueue(group_id, user_id, admin_id, action)
+
+async def log_actions(entries: List[Tuple[int, int, int, str]]):
+    """
+    Log several (group_id, user_id, admin_id, action) entries at once.
+    """
+    log_writer.enqueue_many(entries)
+    for group_id, user_id, admin_id, action in entries:
+        owner_notifier.enqueue(group_id, user_id, admin_id, action)
 
-        await client.send_message(owner_id, log_message)
-    except Exception as e:
-        print(f"Error sending log to owner: {e}")
+async def _load_chat_admins(client: Client, chat_id: int) -> Set[int]:
+    admins = set()
+    bot_member = None
+    async for member in client.get_chat_members(chat_id, filter=ChatMembersFilter.ADMINISTRATORS):
+        admins.add(member.user.id)
+        if member.user.id == bot_user_id:
+            bot_member = member
+    admin_cache.set(chat_id, admins)
+
+    # The roster also tells us whether the bot itself is an admin here
+    if bot_user_id is not None:
+        update_bot_rights(chat_id, bot_member)
+    return admins
+
+async def get_chat_admins(client: Client, chat_id: int) -> Set[int]:
+    """
+    Get the ids of all admins in a chat, loading the roster in bulk on a cache miss.
+    Concurrent misses for the same chat share a single load.
+    """
+    admins = admin_cache.get(chat_id)
+    if admins is not None:
+        return admins
+
+    task = _admin_loads.get(chat_id)
+    if task is None:
+        task = asyncio.ensure_future(_load_chat_admins(client, chat_id))
+        _admin_loads[chat_id] = task
+        task.add_done_callback(lambda _: _admin_loads.pop(chat_id, None))
+    return await asyncio.shield(task)
+
+def update_admin_cache(chat_id: int, user_id: int, status):
+    """
+    Apply a member status change to a cached admin roster, if the chat has one.
+    """
+    admins = admin_cache.get(chat_id)
+    if admins is None:
+        return
+
+    if status in ADMIN_STATUSES:
+        admins.add(user_id)
+    else:
+        admins.discard(user_id)
+
+def cached_is_admin(chat_id: int, user_id: int) -> Optional[bool]:
+    """
+    Check a user against the chat's cached admin roster; None if it is not cached.
+    """
+    admins = admin_cache.get(chat_id)
+    return None if admins is None else user_id in admins
 
 async def is_admin(client: Client, chat_id: int, user_id: int) -> bool:
     """
     Check if a user is an admin in a chat.
     """
+    try:
+        return user_id in await get_chat_admins(client, chat_id)
+    except Exception:
+        pass
+
+    # Fall back to a direct lookup if the roster could not be loaded
     try:
         member = await client.get_chat_member(chat_id, user_id)
-        return member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]
+        return member.status in ADMIN_STATUSES
     except Exception:
         return False
+
+async def get_group_config(chat_id: int) -> Optional[GroupConfig]:
+    """
+    Get a group's config, reading the database only on a cache miss.
+    Groups without a config row are cached as None.
+    """
+    group_config = group_config_cache.get(chat_id, _MISSING)
+    if group_config is _MISSING:
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(GroupConfig).where(GroupConfig.group_id == chat_id)
+            )
+            group_config = result.scalar_one_or_none()
+        group_config_cache.set(chat_id, group_config)
+    return group_config
+
+async def save_group_config(chat_id: int, **fields) -> GroupConfig:
+    """
+    Create or update a group's config and write it through to the cache.
+    """
+    async with SessionLocal() as db:
+        result = await db.execute(
+            select(GroupConfig).where(GroupConfig.group_id == chat_id)
+        )
+        group_config = result.scalar_one_or_none()
+
+        if group_config:
+            for name, value in fields.items():
+                setattr(group_config, name, value)
+        else:
+            group_config = GroupConfig(group_id=chat_id, **fields)
+            db.add(group_config)
+
+        await db.commit()
+        # Load server-side defaults so the cached copy is complete once detached
+        await db.refresh(group_config)
+
+    group_config_cache.set(chat_id, group_config)
+    await broadcast_invalidation("group_configs", chat_id)
+    return group_config
+
+async def add_warning(group_id: int, user_id: int, admin_id: int, reason: Optional[str]) -> int:
+    """
+    Insert a warning and increment the user's warning counter in a single statement,
+    and update the stats rollups in the same transaction.
+    Returns the user's new number of warnings in the group.
+    """
+    new_warning = (
+        insert(Warning)
+        .values(group_id=group_id, user_id=user_id, admin_id=admin_id, reason=reason)
+        .returning(Warning.group_id, Warning.user_id)
+        .cte("new_warning")
+    )
+    statement = (
+        pg_insert(WarningCount)
+        .from_select(
+            ["group_id", "user_id", "count"],
+            select(new_warning.c.group_id, new_warning.c.user_id, literal(1))
+        )
+        .on_conflict_do_update(
+            index_elements=[WarningCount.group_id, WarningCount.user_id],
+            set_={"count": WarningCount.count + 1}
+        )
+        .returning(WarningCount.count)
+        .add_cte(new_warning)
+    )
+
+    async with SessionLocal() as db:
+        warning_count = (await db.execute(statement)).scalar_one()
+        await apply_warning_rollups(db, {user_id: 1})
+        await db.commit()
+    return warning_count
+
+async def remove_latest_warning(group_id: int, user_id: int) -> Optional[int]:
+    """
+    Delete a user's most recent warning and decrement their counter in a single statement,
+    and update the stats rollups in the same transaction.
+    Returns the remaining number of warnings, or None if the user had none.
+    """
+    latest = (
+        select(Warning.id)
+        .where(Warning.group_id == group_id, Warning.user_id == user_id)
+        .order_by(Warning.created_at.desc(), Warning.id.desc())
+        .limit(1)
+        # Waits for a concurrent /unwarn holding the latest warning, then takes the next one
+        .with_for_update()
+        .scalar_subquery()
+    )
+    removed = (
+        delete(Warning)
+        .where(Warning.id == latest)
+        .returning(Warning.group_id, Warning.user_id)
+        .cte("removed_warning")
+    )
+    statement = (
+        update(WarningCount)
+        .where(
+            WarningCount.group_id == removed.c.group_id,
+            WarningCount.user_id == removed.c.user_id
+        )
+        .values(count=WarningCount.count - 1)
+        .returning(WarningCount.count)
+        .add_cte(removed)
+    )
+
+    async with SessionLocal() as db:
+        # Not an ORM bulk update: there are no loaded objects to synchronize
+        warning_count = (
+            await db.execute(statement, execution_options={"synchronize_session": False})
+        ).scalar_one_or_none()
+        if warning_count is not None:
+            await apply_warning_rollups(db, {user_id: -1})
+        await db.commit()
+    return warning_count
@@ -0,0 +1,9 @@
+import os
+
+# Importing the bot package validates these, although no test talks to Telegram
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "test")
+os.environ.setdefault("BOT_TOKEN", "1:test")
+os.environ.setdefault("OWNER_ID", "1")
+# The engine is created on import but never connects in these tests
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://localhost/test")
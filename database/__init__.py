@@ -1,9 +1,10 @@
-from .connection import Base, engine, get_db
+from .connection import Base, engine, get_api_db, get_db
 from .models import  ModerationLog
 
 __all__ = [
     "Base", 
     "engine", 
     "get_db",
+    "get_api_db",
     "ModerationLog"
 ]
\ No newline at end of file
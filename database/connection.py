@@ -1,15 +1,160 @@
 import os
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy import exc
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_async_engine(DATABASE_URL, echo=False)
+
+# Connection pool configuration, shared by the bot and, unless it has its own pool, the API
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+# Seconds a checkout waits for a free connection before failing
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# Seconds after which a connection is replaced; -1 keeps connections indefinitely
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", -1))
+# Test each connection with a round trip when it is checked out
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes")
+# Per-connection statement caches of asyncpg and of SQLAlchemy's asyncpg dialect; 0 for PgBouncer in transaction mode
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", 100))
+# A separate pool for the API when greater than 0, so a busy bot cannot starve the dashboard
+DB_API_POOL_SIZE = int(os.getenv("DB_API_POOL_SIZE", 0))
+DB_API_MAX_OVERFLOW = int(os.getenv("DB_API_MAX_OVERFLOW", DB_MAX_OVERFLOW))
+# Optional read replica for the dashboard's list and aggregate queries, with its own pool
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+DB_REPLICA_POOL_SIZE = int(os.getenv("DB_REPLICA_POOL_SIZE", DB_POOL_SIZE))
+DB_REPLICA_MAX_OVERFLOW = int(os.getenv("DB_REPLICA_MAX_OVERFLOW", DB_MAX_OVERFLOW))
+
+
+class CheckoutStats:
+    __slots__ = ("waiting", "checkouts", "wait_seconds", "max_wait_seconds", "timeouts")
+
+    def __init__(self):
+        self.waiting = 0
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+
+
+# Pool name -> checkout statistics; kept outside the pool, which is replaced when the engine is disposed
+_checkout_stats: Dict[str, CheckoutStats] = {}
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how many checkouts are waiting for a connection
+    and how long they waited.
+    """
+
+    def connect(self):
+        stats = _checkout_stats.setdefault(self._orig_logging_name, CheckoutStats())
+        stats.waiting += 1
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+            stats.checkouts += 1
+            return connection
+        except exc.TimeoutError:
+            stats.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            stats.waiting -= 1
+            stats.wait_seconds += waited
+            stats.max_wait_seconds = max(stats.max_wait_seconds, waited)
+
+
+def make_engine(name: str, pool_size: int, max_overflow: int, url: Optional[str] = None) -> AsyncEngine:
+    url = url or DATABASE_URL
+    connect_args = {}
+    if url and url.startswith("postgresql+asyncpg"):
+        connect_args = {
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": DB_PREPARED_STATEMENT_CACHE_SIZE,
+        }
+    return create_async_engine(
+        url,
+        echo=False,
+        poolclass=InstrumentedPool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_logging_name=name,
+        connect_args=connect_args,
+    )
+
+
+engine = make_engine("main", DB_POOL_SIZE, DB_MAX_OVERFLOW)
 SessionLocal = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+# The dashboard's reads; the same pool as the bot unless DB_API_POOL_SIZE is set
+if DB_API_POOL_SIZE > 0:
+    api_engine = make_engine("api", DB_API_POOL_SIZE, DB_API_MAX_OVERFLOW)
+    ApiSessionLocal = sessionmaker(bind=api_engine, class_=AsyncSession, expire_on_commit=False)
+else:
+    api_engine = engine
+    ApiSessionLocal = SessionLocal
+
+# Reads that tolerate some staleness; database.replica decides when to use it
+if DATABASE_REPLICA_URL:
+    replica_engine = make_engine("replica", DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW, DATABASE_REPLICA_URL)
+    ReplicaSessionLocal = sessionmaker(bind=replica_engine, class_=AsyncSession, expire_on_commit=False)
+else:
+    replica_engine = None
+    ReplicaSessionLocal = None
+
 Base = declarative_base()
 
 async def get_db():
     async with SessionLocal() as session:
         yield session
+
+async def get_api_db():
+    async with ApiSessionLocal() as session:
+        yield session
+
+
+def engines() -> Dict[str, AsyncEngine]:
+    """
+    Each distinct engine by pool name.
+    """
+    found = {"main": engine}
+    if api_engine is not engine:
+        found["api"] = api_engine
+    if replica_engine is not None:
+        found["replica"] = replica_engine
+    return found
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Live state and checkout statistics of each pool.
+    """
+    stats = {}
+    for name, current in engines().items():
+        pool = current.sync_engine.pool
+        checkouts = _checkout_stats.get(name, CheckoutStats())
+        attempts = checkouts.checkouts + checkouts.timeouts
+        stats[name] = {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "waiting": checkouts.waiting,
+            "checkouts": checkouts.checkouts,
+            "timeouts": checkouts.timeouts,
+            "wait_seconds_total": checkouts.wait_seconds,
+            "avg_wait_seconds": checkouts.wait_seconds / attempts if attempts else 0.0,
+            "max_wait_seconds": checkouts.max_wait_seconds,
+        }
+    return stats
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Text, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, String, DateTime, Boolean, Text, ForeignKey, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database.connection import Base
@@ -12,6 +12,13 @@ class ModerationLog(Base):
     action = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_moderation_logs_group_created", "group_id", "created_at"),
+        Index("ix_moderation_logs_user_created", "user_id", "created_at"),
+        Index("ix_moderation_logs_admin_created", "admin_id", "created_at"),
+        Index("ix_moderation_logs_created_id", "created_at", "id"),
+    )
+
 class Warning(Base):
     __tablename__ = "warnings"
     id = Column(Integer, primary_key=True)
@@ -21,6 +28,16 @@ class Warning(Base):
     reason = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_warnings_group_user_created", "group_id", "user_id", "created_at"),
+    )
+
+class WarningCount(Base):
+    __tablename__ = "warning_counts"
+    group_id = Column(BigInteger, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
 class GroupConfig(Base):
     __tablename__ = "group_configs"
     id = Column(Integer, primary_key=True)
@@ -31,3 +48,47 @@ class GroupConfig(Base):
     warn_limit = Column(Integer, default=3)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+class ActiveRestriction(Base):
+    __tablename__ = "active_restrictions"
+    group_id = Column(BigInteger, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    kind = Column(String, primary_key=True)
+    admin_id = Column(BigInteger, nullable=False)
+    # None for restrictions without an end
+    until_date = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_active_restrictions_until", "until_date"),
+        Index("ix_active_restrictions_user", "user_id"),
+    )
+
+# Rollups maintained alongside the raw tables for the /api/stats endpoint
+
+class StatCounter(Base):
+    __tablename__ = "stat_counters"
+    name = Column(String, primary_key=True)
+    # Each total is spread over several rows, summed when read, so writers rarely share a row
+    shard = Column(SmallInteger, primary_key=True, default=0)
+    value = Column(BigInteger, nullable=False, default=0)
+
+class ActionCount(Base):
+    # Keyed by the logged action text, as /api/stats has always reported it
+    __tablename__ = "action_counts"
+    action = Column(String, primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+
+class GroupActivity(Base):
+    __tablename__ = "group_activity"
+    group_id = Column(BigInteger, primary_key=True)
+    action_count = Column(BigInteger, nullable=False, default=0, index=True)
+
+class UserWarningCount(Base):
+    __tablename__ = "user_warning_counts"
+    user_id = Column(BigInteger, primary_key=True)
+    warning_count = Column(BigInteger, nullable=False, default=0, index=True)
+
+class KnownUser(Base):
+    __tablename__ = "known_users"
+    user_id = Column(BigInteger, primary_key=True)
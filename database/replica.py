@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+from sqlalchemy import exc, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.connection import ApiSessionLocal, ReplicaSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Seconds the replica may lag behind the primary before reads go back to the primary
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", 30))
+# Seconds between lag checks, and the longest a check may take before the replica counts as down
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", 5))
+DB_REPLICA_CHECK_TIMEOUT = float(os.getenv("DB_REPLICA_CHECK_TIMEOUT", 2))
+
+# Zero when the replica has replayed everything it received (an idle primary
+# leaves the last replay timestamp behind), NULL when the lag is unknown
+LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+# Errors meaning the replica cannot serve the request, rather than a bad query
+UNAVAILABLE = (exc.DBAPIError, exc.TimeoutError, OSError, asyncio.TimeoutError)
+
+
+class ReplicaRouter:
+    """
+    Sends reads that tolerate some staleness to the replica while it is
+    reachable and at most `max_lag` seconds behind, and to the primary
+    otherwise. The lag is checked at most every `check_interval` seconds,
+    so routing adds no query to most requests.
+    """
+
+    def __init__(self, replica, primary, max_lag: float, check_interval: float, check_timeout: float):
+        self.replica = replica
+        self.primary = primary
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.lag: Optional[float] = None
+        self.healthy = False
+        # Health last logged; None until the first check, so a replica that is down from the start is reported
+        self._logged: Optional[bool] = None
+        self.reason: Optional[str] = "not checked yet" if replica is not None else "not configured"
+        self._checked_at = float("-inf")
+        self._lock: Optional[asyncio.Lock] = None
+        self.replica_reads = 0
+        self.primary_reads = 0
+
+    async def _measure_lag(self) -> Optional[float]:
+        async with self.replica() as db:
+            lag = (await db.execute(LAG_QUERY)).scalar()
+        return None if lag is None else float(lag)
+
+    async def check(self):
+        """
+        Refresh the replica's lag if the last check is older than the interval.
+        """
+        if self.replica is None or time.monotonic() - self._checked_at < self.check_interval:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return
+            try:
+                self.lag = await asyncio.wait_for(self._measure_lag(), self.check_timeout)
+            except UNAVAILABLE as e:
+                self.lag = None
+                self._set_health(False, f"unreachable: {type(e).__name__}")
+            else:
+                if self.lag is None:
+                    self._set_health(False, "lag unknown")
+                elif self.lag > self.max_lag:
+                    self._set_health(False, f"{self.lag:.1f}s behind")
+                else:
+                    self._set_health(True, None)
+            self._checked_at = time.monotonic()
+
+    def _set_health(self, healthy: bool, reason: Optional[str]):
+        if healthy != self._logged:
+            if healthy:
+                logger.info("Routing dashboard reads to the read replica")
+            else:
+                logger.warning("Read replica %s, routing dashboard reads to the primary", reason)
+            self._logged = healthy
+        self.healthy = healthy
+        self.reason = reason
+
+    @asynccontextmanager
+    async def session(self):
+        """
+        A session on the replica when it is usable, otherwise on the primary.
+        A replica that fails to hand out a connection is marked down until
+        the next check, and the request falls back to the primary.
+        """
+        await self.check()
+        session: Optional[AsyncSession] = None
+        if self.healthy:
+            session = self.replica()
+            try:
+                await session.connection()
+            except UNAVAILABLE as e:
+                await session.close()
+                session = None
+                self._set_health(False, f"unreachable: {type(e).__name__}")
+                self._checked_at = time.monotonic()
+
+        if session is None:
+            self.primary_reads += 1
+            session = self.primary()
+        else:
+            self.replica_reads += 1
+        async with session:
+            yield session
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "configured": self.replica is not None,
+            "healthy": self.healthy,
+            "reason": self.reason,
+            "lag_seconds": self.lag,
+            "max_lag_seconds": self.max_lag,
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+        }
+
+
+replica_router = ReplicaRouter(
+    replica=ReplicaSessionLocal,
+    primary=ApiSessionLocal,
+    max_lag=DB_REPLICA_MAX_LAG,
+    check_interval=DB_REPLICA_CHECK_INTERVAL,
+    check_timeout=DB_REPLICA_CHECK_TIMEOUT,
+)
+
+
+async def get_replica_db():
+    async with replica_router.session() as session:
+        yield session
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import os
+import random
+from collections import Counter
+from typing import Any, Dict, Iterable, List
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from database.connection import SessionLocal
+from database.models import (
+    ActionCount, GroupActivity, KnownUser, ModerationLog, StatCounter, UserWarningCount, Warning
+)
+
+logger = logging.getLogger(__name__)
+
+# Rows each stat_counters total is spread over
+STAT_COUNTER_SHARDS = int(os.getenv("STAT_COUNTER_SHARDS", 16))
+
+# Names of the rows in stat_counters
+TOTAL_ACTIONS = "total_actions"
+TOTAL_WARNINGS = "total_warnings"
+TOTAL_USERS = "total_users"
+
+# Actions whose first word does not name the action
+ACTION_TYPES = {
+    "joined the group": "join",
+    "left the group": "leave",
+    "was banned from the group": "leave",
+}
+
+
+def action_type(action: str) -> str:
+    """
+    Reduce a logged action such as "warn (2/3): spam" to its type ("warn").
+    """
+    if action in ACTION_TYPES:
+        return ACTION_TYPES[action]
+    return action.split(" ", 1)[0].rstrip(":")
+
+
+async def _bump_counters(db, deltas: Dict[str, int]):
+    # One random shard per transaction, so concurrent log flushes and warnings seldom wait on each other
+    shard = random.randrange(STAT_COUNTER_SHARDS)
+    values = [{"name": name, "shard": shard, "value": delta} for name, delta in sorted(deltas.items()) if delta]
+    if not values:
+        return
+    statement = pg_insert(StatCounter).values(values)
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[StatCounter.name, StatCounter.shard],
+        set_={"value": StatCounter.value + statement.excluded.value}
+    ))
+
+
+async def _remember_users(db, user_ids: Iterable[int]) -> int:
+    """
+    Record users in known_users and return how many had not been seen before.
+    """
+    values = [{"user_id": user_id} for user_id in sorted(set(user_ids))]
+    if not values:
+        return 0
+    result = await db.execute(
+        pg_insert(KnownUser).values(values).on_conflict_do_nothing().returning(KnownUser.user_id)
+    )
+    return len(result.all())
+
+
+async def apply_log_rollups(db, rows: List[Dict[str, Any]]):
+    """
+    Add a batch of ModerationLog rows to the rollups, inside the caller's transaction.
+    """
+    if not rows:
+        return
+
+    actions = Counter(row["action"] for row in rows)
+    statement = pg_insert(ActionCount).values(
+        [{"action": action, "count": count} for action, count in sorted(actions.items())]
+    )
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[ActionCount.action],
+        set_={"count": ActionCount.count + statement.excluded["count"]}
+    ))
+
+    groups = Counter(row["group_id"] for row in rows)
+    statement = pg_insert(GroupActivity).values(
+        [{"group_id": group_id, "action_count": count} for group_id, count in sorted(groups.items())]
+    )
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[GroupActivity.group_id],
+        set_={"action_count": GroupActivity.action_count + statement.excluded.action_count}
+    ))
+
+    new_users = await _remember_users(db, (row["user_id"] for row in rows))
+    await _bump_counters(db, {TOTAL_ACTIONS: len(rows), TOTAL_USERS: new_users})
+
+
+async def apply_warning_rollups(db, deltas: Dict[int, int]):
+    """
+    Apply per-user warning count changes (user_id -> delta) inside the caller's transaction.
+    """
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    statement = pg_insert(UserWarningCount).values(
+        [{"user_id": user_id, "warning_count": delta} for user_id, delta in sorted(deltas.items())]
+    )
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[UserWarningCount.user_id],
+        set_={"warning_count": UserWarningCount.warning_count + statement.excluded.warning_count}
+    ))
+
+    new_users = await _remember_users(db, (user_id for user_id, delta in deltas.items() if delta > 0))
+    await _bump_counters(db, {TOTAL_WARNINGS: sum(deltas.values()), TOTAL_USERS: new_users})
+
+
+async def rebuild_rollups(db):
+    """
+    Recompute every rollup from moderation_logs and warnings. Runs in the
+    caller's transaction, so readers see either the old or the new rollups.
+    Rollup writes from a running bot wait until the rebuild commits.
+    """
+    await db.execute(text(
+        "LOCK TABLE stat_counters, action_counts, group_activity, user_warning_counts, known_users "
+        "IN EXCLUSIVE MODE"
+    ))
+    for model in (StatCounter, ActionCount, GroupActivity, UserWarningCount, KnownUser):
+        await db.execute(delete(model))
+
+    await db.execute(pg_insert(ActionCount).from_select(
+        ["action", "count"],
+        select(ModerationLog.action, func.count()).group_by(ModerationLog.action)
+    ))
+    await db.execute(pg_insert(GroupActivity).from_select(
+        ["group_id", "action_count"],
+        select(ModerationLog.group_id, func.count()).group_by(ModerationLog.group_id)
+    ))
+    await db.execute(pg_insert(UserWarningCount).from_select(
+        ["user_id", "warning_count"],
+        select(Warning.user_id, func.count()).group_by(Warning.user_id)
+    ))
+    await db.execute(pg_insert(KnownUser).from_select(
+        ["user_id"],
+        select(ModerationLog.user_id).union(select(Warning.user_id))
+    ))
+
+    totals = {
+        TOTAL_ACTIONS: (await db.execute(select(func.count(ModerationLog.id)))).scalar(),
+        TOTAL_WARNINGS: (await db.execute(select(func.count(Warning.id)))).scalar(),
+        TOTAL_USERS: (await db.execute(select(func.count()).select_from(KnownUser))).scalar(),
+    }
+    await db.execute(pg_insert(StatCounter).values(
+        [{"name": name, "shard": 0, "value": value or 0} for name, value in totals.items()]
+    ))
+
+
+async def main():
+    async with SessionLocal() as db:
+        await rebuild_rollups(db)
+        await db.commit()
+    logger.info("Rollups rebuilt from moderation_logs and warnings")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
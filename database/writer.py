@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import exc, insert
+
+from database.connection import SessionLocal
+from database.models import ModerationLog
+from database.rollups import apply_log_rollups
+
+logger = logging.getLogger(__name__)
+
+# Write-behind configuration
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 500))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 1.0))
+LOG_QUEUE_LIMIT = int(os.getenv("LOG_QUEUE_LIMIT", 100000))
+# Failed writes of the same batch, other than the database being unreachable, before it is dropped
+LOG_MAX_ATTEMPTS = int(os.getenv("LOG_MAX_ATTEMPTS", 5))
+
+# Errors meaning the database cannot be reached, rather than that the batch is bad
+UNAVAILABLE = (OSError, asyncio.TimeoutError, exc.TimeoutError, exc.InterfaceError, exc.OperationalError)
+
+
+class LogWriter:
+    """
+    Buffers ModerationLog rows in memory and writes them with one multi-row
+    INSERT per batch, either when the batch is full or when the flush interval
+    elapses. Rows are timestamped when they are queued, not when they are written.
+    The /api/stats rollups are updated in the same transaction as each batch.
+    A batch that fails `max_attempts` times while the database is reachable
+    is logged and dropped, so one bad row cannot hold up every later one.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_pending: int, max_attempts: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._pending: List[Dict[str, Any]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # Failed writes of the batch at the head of the queue
+        self._attempts = 0
+
+        # Counters exposed through stats()
+        self.flushed_rows = 0
+        self.dropped_rows = 0
+        self.rejected_rows = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def enqueue(self, group_id: int, user_id: int, admin_id: int, action: str):
+        """
+        Queue a log row without waiting for the database.
+        """
+        self._pending.append({
+            "group_id": group_id,
+            "user_id": user_id,
+            "admin_id": admin_id,
+            "action": action,
+            "created_at": datetime.now(timezone.utc),
+        })
+        self._trim()
+
+        if len(self._pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def enqueue_many(self, entries: Iterable[Tuple[int, int, int, str]]):
+        """
+        Queue several (group_id, user_id, admin_id, action) rows at once.
+        """
+        created_at = datetime.now(timezone.utc)
+        self._pending.extend(
+            {
+                "group_id": group_id,
+                "user_id": user_id,
+                "admin_id": admin_id,
+                "action": action,
+                "created_at": created_at,
+            }
+            for group_id, user_id, admin_id, action in entries
+        )
+        self._trim()
+
+        if len(self._pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _trim(self):
+        # Shed the oldest rows rather than grow without bound while the database is down
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            del self._pending[:overflow]
+            self.dropped_rows += overflow
+            logger.warning(f"Log queue full, dropped {overflow} rows")
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the background task and write out everything still queued.
+        A flush in progress is allowed to finish rather than cancelled.
+        """
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await self._task
+            finally:
+                self._task = None
+                self._stopping = False
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """
+        Write all queued rows, one INSERT per batch.
+        """
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            while self._pending:
+                rows = self._pending[:self.batch_size]
+                del self._pending[:len(rows)]
+
+                started = time.perf_counter()
+                try:
+                    async with SessionLocal() as db:
+                        await db.execute(insert(ModerationLog).values(rows))
+                        await apply_log_rollups(db, rows)
+                        await db.commit()
+                except BaseException as e:
+                    # Keep the rows for the next attempt, also when the flush is cancelled
+                    self._pending[:0] = rows
+                    if not isinstance(e, Exception):
+                        raise
+                    logger.error(f"Error flushing {len(rows)} moderation logs: {e}")
+                    self.failed_flushes += 1
+                    if not isinstance(e, UNAVAILABLE):
+                        self._attempts += 1
+                        if self._attempts >= self.max_attempts:
+                            self._reject(rows)
+                            continue
+                    self._trim()
+                    return
+
+                self._attempts = 0
+                elapsed = time.perf_counter() - started
+                self.flushes += 1
+                self.flushed_rows += len(rows)
+                self.last_flush_seconds = elapsed
+                self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+    def _reject(self, rows: List[Dict[str, Any]]):
+        # The rows are at the head of the queue, where the failed flush put them back
+        del self._pending[:len(rows)]
+        self._attempts = 0
+        self.rejected_rows += len(rows)
+        logger.error(f"Dropped {len(rows)} moderation logs after {self.max_attempts} failed writes: {rows}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": len(self._pending),
+            "flushed_rows": self.flushed_rows,
+            "dropped_rows": self.dropped_rows,
+            "rejected_rows": self.rejected_rows,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+        }
+
+
+log_writer = LogWriter(
+    batch_size=LOG_BATCH_SIZE,
+    flush_interval=LOG_FLUSH_INTERVAL,
+    max_pending=LOG_QUEUE_LIMIT,
+    max_attempts=LOG_MAX_ATTEMPTS,
+)
@@ -1,11 +1,15 @@
 import asyncio
 import logging
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect, select
 from sqlalchemy.ext.asyncio import create_async_engine
 from dotenv import load_dotenv
 import os
 import time
 
-from database.connection import Base
+from database.models import StatCounter
+from database.rollups import rebuild_rollups
 
 # Configure logging
 logging.basicConfig(
@@ -14,9 +18,38 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+ALEMBIC_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+
+
+def run_migrations(connection):
+    """Apply all pending migrations on an open connection"""
+    config = Config(ALEMBIC_CONFIG)
+    config.attributes["connection"] = connection
+    config.attributes["configure_logger"] = False
+
+    # Databases created with create_all before migrations existed have the
+    # tables but no version; mark the revision they already match
+    tables = set(inspect(connection).get_table_names())
+    if "alembic_version" not in tables and "moderation_logs" in tables:
+        revision = "0002" if "warning_counts" in tables else "0001"
+        logger.info(f"Stamping existing schema at revision {revision}")
+        command.stamp(config, revision)
+
+    # End the transaction the inspection began, so alembic manages its own and
+    # migrations that build indexes concurrently can step outside it
+    connection.commit()
+    command.upgrade(config, "head")
+
+
+async def backfill_rollups(conn):
+    """Fill the stats rollups from the raw tables the first time they exist"""
+    if (await conn.execute(select(StatCounter.name).limit(1))).first() is None:
+        logger.info("Building stats rollups from existing data")
+        await rebuild_rollups(conn)
+
 
 async def init_db():
-    """Initialize the database and create tables"""
+    """Initialize the database by applying migrations"""
     load_dotenv()
     DATABASE_URL = os.getenv("DATABASE_URL")
 
@@ -30,12 +63,15 @@ async def init_db():
     max_retries = 10
     for attempt in range(1, max_retries + 1):
         try:
-            async with engine.begin() as conn:
-                await conn.run_sync(Base.metadata.create_all)
-            logger.info("Database tables created successfully")
+            async with engine.connect() as conn:
+                await conn.run_sync(run_migrations)
+                await conn.commit()
+                await backfill_rollups(conn)
+                await conn.commit()
+            logger.info("Database migrations applied successfully")
             break
         except Exception as e:
-            logger.error(f"Attempt {attempt}: Error creating database tables: {e}")
+            logger.error(f"Attempt {attempt}: Error applying database migrations: {e}")
             if attempt == max_retries:
                 logger.error("Max retries reached. Exiting.")
                 raise
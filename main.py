@@ -1,17 +1,94 @@
 import os
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-from bot.client import start_bot
-from api.routes import router as api_router
+from bot.cache import admin_cache, bot_rights_cache, group_config_cache, peer_cache
+from bot.client import start_bot, stop_bot
+from bot.greetings import greetings
+from bot.pipeline import stage_timings
+from bot.ratelimit import command_limits
+from bot.restrictions import restriction_scheduler
+from bot.scheduler import outbound_scheduler
+from bot.state import MemoryBackend, state_backend
+from bot.templates import compiled_templates
+from api.routes import API_KEY_NAME, NEXT_CURSOR_HEADER, health_checks, router as api_router
+from database.connection import engines, pool_stats
+from database.replica import replica_router
+from database.writer import log_writer
+import metrics
+import profiling
 
 load_dotenv()
 app = FastAPI()
 
+# Comma-separated origins of browser dashboards allowed to call the API; empty for same-origin only
+API_CORS_ORIGINS = [origin.strip() for origin in os.getenv("API_CORS_ORIGINS", "").split(",") if origin.strip()]
+if API_CORS_ORIGINS:
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=API_CORS_ORIGINS,
+        allow_methods=["GET", "POST"],
+        allow_headers=[API_KEY_NAME],
+        # Lets a dashboard read the cursor of the next page
+        expose_headers=[NEXT_CURSOR_HEADER],
+    )
+
 @app.on_event("startup")
 async def startup_event():
     await start_bot()
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop_bot()
+
 app.include_router(api_router)
+health_checks["outbound_queue"] = outbound_scheduler.stats
+health_checks["greetings"] = greetings.stats
+health_checks["commands"] = stage_timings.stats
+health_checks["command_limits"] = command_limits.stats
+if isinstance(state_backend, MemoryBackend):
+    # With Redis the buckets live on the server and expire there
+    health_checks["rate_limit_buckets"] = state_backend.limiter.stats
+health_checks["restrictions"] = restriction_scheduler.stats
+health_checks["db_pools"] = pool_stats
+health_checks["db_replica"] = replica_router.stats
+
+# Prometheus metrics; cache and queue figures are read at scrape time
+for engine in engines().values():
+    metrics.instrument_engine(engine)
+    # Statements run while handling an update show up in its span tree
+    profiling.trace_engine(engine)
+for name, cache in {
+    "admins": admin_cache,
+    "bot_rights": bot_rights_cache,
+    "group_configs": group_config_cache,
+    "peer_users": peer_cache.users,
+    "peer_chats": peer_cache.chats,
+    "peer_usernames": peer_cache.usernames,
+    "templates": compiled_templates,
+}.items():
+    metrics.collector.add_cache(name, cache)
+metrics.collector.add_gauge("log_queue_depth", "Log rows waiting to be written", lambda: log_writer.stats()["queue_depth"])
+metrics.collector.add_gauge("telegram_queue_depth", "MTProto calls queued or deferred by the outbound scheduler",
+                            outbound_scheduler.depth)
+metrics.collector.add_gauge("restrictions_scheduled", "Timed restrictions waiting to expire",
+                            lambda: restriction_scheduler.stats()["scheduled"])
+metrics.collector.add_pools(pool_stats)
+metrics.collector.add_command_limits(command_limits)
+if isinstance(state_backend, MemoryBackend):
+    metrics.collector.add_gauge("rate_limit_buckets", "Command rate-limit buckets not yet refilled",
+                                lambda: len(state_backend.limiter))
+    metrics.collector.add_counter("rate_limit_buckets_evicted", "Refilled rate-limit buckets dropped",
+                                  lambda: state_backend.limiter.evicted)
+metrics.collector.add_gauge("db_replica_healthy", "1 while dashboard reads go to the read replica",
+                            lambda: float(replica_router.healthy))
+metrics.collector.add_gauge("db_replica_lag_seconds", "Replication lag at the last check",
+                            lambda: replica_router.lag if replica_router.lag is not None else float("nan"))
+
+@app.get("/metrics")
+def metrics_endpoint():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
 
 @app.get("/")
 async def root():
@@ -0,0 +1,210 @@
+import functools
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+
+from profiling import trace
+
+# Buckets in seconds, from a cache-speed lookup to a slow FloodWait-free round trip
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HANDLER_SECONDS = Histogram(
+    "bot_handler_duration_seconds", "Time spent in each update handler",
+    ["handler"], buckets=LATENCY_BUCKETS,
+)
+COMMAND_SECONDS = Histogram(
+    "bot_command_duration_seconds", "Time spent in each command pipeline stage",
+    ["command", "stage"], buckets=LATENCY_BUCKETS,
+)
+TELEGRAM_REQUESTS = Counter(
+    "telegram_requests_total", "MTProto calls by method and outcome",
+    ["method", "outcome"],
+)
+TELEGRAM_REQUEST_SECONDS = Histogram(
+    "telegram_request_duration_seconds", "MTProto call round trip, excluding time queued",
+    ["method"], buckets=LATENCY_BUCKETS,
+)
+TELEGRAM_QUEUE_SECONDS = Histogram(
+    "telegram_queue_wait_seconds", "Time MTProto calls wait in the outbound queue",
+    ["priority"], buckets=LATENCY_BUCKETS,
+)
+FLOOD_WAITS = Counter(
+    "telegram_flood_waits_total", "FloodWait errors by method",
+    ["method"],
+)
+FLOOD_WAIT_SECONDS = Counter(
+    "telegram_flood_wait_seconds_total", "Seconds of FloodWait imposed, by method",
+    ["method"],
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "SQL statement execution time by statement type",
+    ["operation"], buckets=LATENCY_BUCKETS,
+)
+
+
+def method_label(qualname: str) -> str:
+    # "functions.channels.EditBanned" -> "channels.EditBanned"
+    return qualname[10:] if qualname.startswith("functions.") else qualname
+
+
+async def instrument_handlers(client):
+    """
+    Time every handler registered on a started client, labelled by callback
+    name, and trace each call so slow updates are logged with their spans.
+    """
+    # Plugins are added by tasks that hold these locks; waiting on them lets those finish first
+    dispatcher = client.dispatcher
+    for lock in dispatcher.locks_list:
+        await lock.acquire()
+    try:
+        for handlers in dispatcher.groups.values():
+            for handler in handlers:
+                if not getattr(handler.callback, "__instrumented__", False):
+                    handler.callback = _timed_handler(handler.callback)
+    finally:
+        for lock in dispatcher.locks_list:
+            lock.release()
+
+
+def _timed_handler(callback: Callable):
+    histogram = HANDLER_SECONDS.labels(callback.__name__)
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            with trace(callback.__name__):
+                return await callback(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def instrument_engine(engine):
+    """
+    Time every statement run through an (async) engine.
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if getattr(sync_engine, "_metrics_instrumented", False):
+        return
+    sync_engine._metrics_instrumented = True
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        DB_QUERY_SECONDS.labels(_operation(statement)).observe(elapsed)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+
+def _operation(statement: str) -> str:
+    # Statement type only, so the label set stays small
+    head = statement.lstrip()[:8].split(None, 1)
+    return head[0].upper() if head else "UNKNOWN"
+
+
+class StatsCollector:
+    """
+    Reads counters the bot keeps anyway (cache hits, queue depths) when
+    Prometheus scrapes, so they cost nothing on the hot path.
+    """
+
+    def __init__(self):
+        self._caches: Dict[str, Any] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+        self._counters: Dict[str, Tuple[str, Callable[[], float]]] = {}
+        self._command_limits: Optional[Any] = None
+        self._pools: Optional[Callable[[], Dict[str, Dict[str, float]]]] = None
+
+    def add_cache(self, name: str, cache):
+        self._caches[name] = cache
+
+    def add_gauge(self, name: str, documentation: str, read: Callable[[], float]):
+        self._gauges[name] = (documentation, read)
+
+    def add_counter(self, name: str, documentation: str, read: Callable[[], float]):
+        self._counters[name] = (documentation, read)
+
+    def add_command_limits(self, limits):
+        """
+        `limits` counts allowed and denied uses per command, as
+        bot.ratelimit.CommandLimits does.
+        """
+        self._command_limits = limits
+
+    def add_pools(self, read: Callable[[], Dict[str, Dict[str, float]]]):
+        """
+        `read` returns the state of each database pool by name, as
+        database.connection.pool_stats does.
+        """
+        self._pools = read
+
+    def collect(self):
+        hits = CounterMetricFamily("cache_hits", "Cache lookups that found a live entry", labels=["cache"])
+        misses = CounterMetricFamily("cache_misses", "Cache lookups that found nothing or an expired entry", labels=["cache"])
+        entries = GaugeMetricFamily("cache_entries", "Entries held by each cache", labels=["cache"])
+        for name, cache in self._caches.items():
+            hits.add_metric([name], cache.hits)
+            misses.add_metric([name], cache.misses)
+            entries.add_metric([name], len(cache))
+        yield hits
+        yield misses
+        yield entries
+
+        for name, (documentation, read) in self._gauges.items():
+            yield GaugeMetricFamily(name, documentation, value=read())
+        for name, (documentation, read) in self._counters.items():
+            yield CounterMetricFamily(name, documentation, value=read())
+
+        if self._command_limits is not None:
+            uses = CounterMetricFamily("command_rate_limit_checks", "Command uses checked against their rate limit",
+                                       labels=["command", "outcome"])
+            for outcome, counts in (("allowed", self._command_limits.allowed), ("denied", self._command_limits.denied)):
+                for command, count in counts.items():
+                    uses.add_metric([command, outcome], count)
+            yield uses
+
+        if self._pools is not None:
+            yield from self._collect_pools(self._pools())
+
+    @staticmethod
+    def _collect_pools(pools: Dict[str, Dict[str, float]]):
+        families = [
+            (GaugeMetricFamily, "db_pool_size", "Connections the pool keeps open", "size"),
+            (GaugeMetricFamily, "db_pool_checked_out", "Connections in use", "checked_out"),
+            (GaugeMetricFamily, "db_pool_idle", "Open connections waiting in the pool", "idle"),
+            (GaugeMetricFamily, "db_pool_overflow", "Connections open beyond the pool size", "overflow"),
+            (GaugeMetricFamily, "db_pool_waiting", "Checkouts waiting for a connection", "waiting"),
+            (CounterMetricFamily, "db_pool_checkouts", "Connections checked out of the pool", "checkouts"),
+            (CounterMetricFamily, "db_pool_timeouts", "Checkouts that gave up waiting for a connection", "timeouts"),
+            (CounterMetricFamily, "db_pool_wait_seconds", "Time spent waiting to check out a connection", "wait_seconds_total"),
+        ]
+        for family, name, documentation, key in families:
+            metric = family(name, documentation, labels=["pool"])
+            for pool, stats in pools.items():
+                metric.add_metric([pool], stats[key])
+            yield metric
+
+
+collector = StatsCollector()
+REGISTRY.register(collector)
+
+
+def render() -> Tuple[bytes, str]:
+    """
+    Return the exposition text for every metric and its content type.
+    """
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
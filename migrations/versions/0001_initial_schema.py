@@ -0,0 +1,52 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "moderation_logs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("group_id", sa.BigInteger(), nullable=False),
+        sa.Column("user_id", sa.BigInteger(), nullable=False),
+        sa.Column("admin_id", sa.BigInteger(), nullable=False),
+        sa.Column("action", sa.String(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_table(
+        "warnings",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("group_id", sa.BigInteger(), nullable=False),
+        sa.Column("user_id", sa.BigInteger(), nullable=False),
+        sa.Column("admin_id", sa.BigInteger(), nullable=False),
+        sa.Column("reason", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_table(
+        "group_configs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("group_id", sa.BigInteger(), nullable=False, unique=True),
+        sa.Column("welcome_message", sa.Text(), nullable=True),
+        sa.Column("goodbye_message", sa.Text(), nullable=True),
+        sa.Column("rules", sa.Text(), nullable=True),
+        sa.Column("warn_limit", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table("group_configs")
+    op.drop_table("warnings")
+    op.drop_table("moderation_logs")
@@ -0,0 +1,35 @@
+"""warning counters
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "warning_counts",
+        sa.Column("group_id", sa.BigInteger(), primary_key=True),
+        sa.Column("user_id", sa.BigInteger(), primary_key=True),
+        sa.Column("count", sa.Integer(), nullable=False),
+    )
+
+    # Seed the counters from the warnings that already exist
+    op.execute(
+        """
+        INSERT INTO warning_counts (group_id, user_id, count)
+        SELECT group_id, user_id, count(*) FROM warnings GROUP BY group_id, user_id
+        """
+    )
+
+
+def downgrade():
+    op.drop_table("warning_counts")
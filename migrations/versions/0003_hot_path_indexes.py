@@ -0,0 +1,33 @@
+"""indexes for the warning and log access paths
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_warnings_group_user_created", "warnings", ["group_id", "user_id", "created_at"]),
+    ("ix_moderation_logs_group_created", "moderation_logs", ["group_id", "created_at"]),
+    ("ix_moderation_logs_user_created", "moderation_logs", ["user_id", "created_at"]),
+    ("ix_moderation_logs_admin_created", "moderation_logs", ["admin_id", "created_at"]),
+]
+
+
+def upgrade():
+    # Build concurrently so existing deployments keep accepting writes
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
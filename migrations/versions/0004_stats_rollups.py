@@ -0,0 +1,54 @@
+"""rollup tables for /api/stats
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "stat_counters",
+        sa.Column("name", sa.String(), primary_key=True),
+        sa.Column("value", sa.BigInteger(), nullable=False),
+    )
+    op.create_table(
+        "action_counts",
+        sa.Column("action", sa.String(), primary_key=True),
+        sa.Column("count", sa.BigInteger(), nullable=False),
+    )
+    op.create_table(
+        "group_activity",
+        sa.Column("group_id", sa.BigInteger(), primary_key=True),
+        sa.Column("action_count", sa.BigInteger(), nullable=False),
+    )
+    op.create_index("ix_group_activity_action_count", "group_activity", ["action_count"])
+    op.create_table(
+        "user_warning_counts",
+        sa.Column("user_id", sa.BigInteger(), primary_key=True),
+        sa.Column("warning_count", sa.BigInteger(), nullable=False),
+    )
+    op.create_index("ix_user_warning_counts_warning_count", "user_warning_counts", ["warning_count"])
+    op.create_table(
+        "known_users",
+        sa.Column("user_id", sa.BigInteger(), primary_key=True),
+    )
+    # The tables start empty; existing data is loaded with `python -m database.rollups`
+
+
+def downgrade():
+    op.drop_table("known_users")
+    op.drop_index("ix_user_warning_counts_warning_count", table_name="user_warning_counts")
+    op.drop_table("user_warning_counts")
+    op.drop_index("ix_group_activity_action_count", table_name="group_activity")
+    op.drop_table("group_activity")
+    op.drop_table("action_counts")
+    op.drop_table("stat_counters")
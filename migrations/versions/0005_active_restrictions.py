@@ -0,0 +1,34 @@
+"""active_restrictions table
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "active_restrictions",
+        sa.Column("group_id", sa.BigInteger(), primary_key=True),
+        sa.Column("user_id", sa.BigInteger(), primary_key=True),
+        sa.Column("kind", sa.String(), primary_key=True),
+        sa.Column("admin_id", sa.BigInteger(), nullable=False),
+        sa.Column("until_date", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_active_restrictions_until", "active_restrictions", ["until_date"])
+    op.create_index("ix_active_restrictions_user", "active_restrictions", ["user_id"])
+
+
+def downgrade():
+    op.drop_index("ix_active_restrictions_user", table_name="active_restrictions")
+    op.drop_index("ix_active_restrictions_until", table_name="active_restrictions")
+    op.drop_table("active_restrictions")
@@ -0,0 +1,30 @@
+"""index for the unfiltered /api/logs page order
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keyset pages are read in (created_at, id) order; built concurrently like the other log indexes
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_moderation_logs_created_id", "moderation_logs", ["created_at", "id"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_moderation_logs_created_id", table_name="moderation_logs",
+            postgresql_concurrently=True, if_exists=True,
+        )
@@ -0,0 +1,40 @@
+"""shard stat_counters and count actions by their logged text
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing totals become shard 0
+    op.add_column("stat_counters", sa.Column("shard", sa.SmallInteger(), nullable=False, server_default="0"))
+    op.drop_constraint("stat_counters_pkey", "stat_counters", type_="primary")
+    op.create_primary_key("stat_counters_pkey", "stat_counters", ["name", "shard"])
+
+    # action_counts held normalized types; /api/stats reports the logged text again
+    op.execute("DELETE FROM action_counts")
+    op.execute(
+        "INSERT INTO action_counts (action, count) "
+        "SELECT action, count(*) FROM moderation_logs GROUP BY action"
+    )
+
+
+def downgrade():
+    op.execute("""
+        WITH merged AS (DELETE FROM stat_counters RETURNING name, value)
+        INSERT INTO stat_counters (name, shard, value) SELECT name, 0, sum(value) FROM merged GROUP BY name
+    """)
+    op.drop_constraint("stat_counters_pkey", "stat_counters", type_="primary")
+    op.drop_column("stat_counters", "shard")
+    op.create_primary_key("stat_counters_pkey", "stat_counters", ["name"])
+    # The earlier revision counts actions by type; refill with `python -m database.rollups` from that revision
+    op.execute("DELETE FROM action_counts")
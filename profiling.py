@@ -0,0 +1,241 @@
+import functools
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter as Tally
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Updates taking longer than this many seconds are logged with their span tree
+SLOW_UPDATE_THRESHOLD = float(os.getenv("SLOW_UPDATE_THRESHOLD", 1.0))
+# Spans shorter than this many seconds are left out of the slow update log
+SLOW_UPDATE_MIN_SPAN = float(os.getenv("SLOW_UPDATE_MIN_SPAN", 0.001))
+# Seconds between stack samples, and the longest a profile may run before it stops by itself
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", 300))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class Span:
+    """
+    A timed step of handling an update, with the steps it made.
+    """
+
+    __slots__ = ("name", "started", "ended", "children")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.ended: Optional[float] = None
+        self.children: List["Span"] = []
+
+    def finish(self):
+        self.ended = time.perf_counter()
+
+    @property
+    def seconds(self) -> float:
+        return (self.ended or time.perf_counter()) - self.started
+
+    def format(self, min_seconds: float = 0.0, depth: int = 0) -> List[str]:
+        """
+        One line per span, indented by depth; children shorter than
+        `min_seconds` are counted rather than listed.
+        """
+        lines = [f"{self.seconds * 1000:9.1f} ms  {'  ' * depth}{self.name}"]
+        hidden = 0
+        for child in self.children:
+            if child.seconds < min_seconds:
+                hidden += 1
+            else:
+                lines.extend(child.format(min_seconds, depth + 1))
+        if hidden:
+            lines.append(f"{'':12} {'  ' * (depth + 1)}({hidden} shorter spans)")
+        return lines
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("profiling_span", default=None)
+
+
+@contextmanager
+def trace(name: str, threshold: float = SLOW_UPDATE_THRESHOLD):
+    """
+    Record the spans opened while handling one update, and log the tree if
+    it took longer than `threshold` seconds. Inside another trace this is
+    an ordinary span.
+    """
+    if _current.get() is not None:
+        with span(name) as current:
+            yield current
+        return
+
+    root = Span(name)
+    token = _current.set(root)
+    try:
+        yield root
+    finally:
+        root.finish()
+        _current.reset(token)
+        if root.seconds >= threshold:
+            logger.warning("Slow update (%.0f ms):\n%s", root.seconds * 1000,
+                           "\n".join(root.format(SLOW_UPDATE_MIN_SPAN)))
+
+
+@contextmanager
+def span(name: str):
+    """
+    Time a step of the update being traced; does nothing outside a trace.
+    """
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name)
+    parent.children.append(child)
+    token = _current.set(child)
+    try:
+        yield child
+    finally:
+        child.finish()
+        _current.reset(token)
+
+
+def traced(method: Callable, name: Optional[str] = None):
+    """
+    Wrap a coroutine method so each call is a span named after it.
+    """
+    label = name or method.__name__
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        if _current.get() is None:
+            return await method(*args, **kwargs)
+        with span(label):
+            return await method(*args, **kwargs)
+
+    return wrapper
+
+
+def trace_engine(engine):
+    """
+    Add a span for every statement an (async) engine runs inside a trace.
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if getattr(sync_engine, "_profiling_instrumented", False):
+        return
+    sync_engine._profiling_instrumented = True
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        parent = _current.get()
+        if parent is None:
+            return
+        child = Span("sql " + _WHITESPACE.sub(" ", statement)[:80])
+        parent.children.append(child)
+        conn.info.setdefault("profiling_spans", []).append(child)
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("profiling_spans")
+        if spans:
+            spans.pop().finish()
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        spans = context.connection.info.get("profiling_spans") if context.connection is not None else None
+        if spans:
+            spans.pop().finish()
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of the thread running the event loop from a background
+    thread, so a live process can be profiled without restarting it. The
+    result is in collapsed-stack form, ready for flamegraph tools.
+    """
+
+    def __init__(self, max_seconds: float):
+        self.max_seconds = max_seconds
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._stacks: Tally = Tally()
+        self._target: Optional[int] = None
+        self._interval = PROFILE_INTERVAL
+        self._started = 0.0
+        self._ended = 0.0
+        self.samples = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = PROFILE_INTERVAL):
+        """
+        Start sampling the calling thread; raises RuntimeError if already running.
+        """
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        self._stacks = Tally()
+        self.samples = 0
+        self._interval = interval
+        self._target = threading.get_ident()
+        self._stop.clear()
+        self._started = time.perf_counter()
+        self._ended = 0.0
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self, top: int = 50) -> Dict[str, Any]:
+        """
+        Stop sampling (if still running) and return the profile.
+        """
+        if self._thread is None:
+            raise RuntimeError("No profile has been started")
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        return self.result(top)
+
+    def _sample(self):
+        deadline = self._started + self.max_seconds
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self._stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+            if time.perf_counter() >= deadline:
+                break
+        self._ended = time.perf_counter()
+
+    def result(self, top: int = 50) -> Dict[str, Any]:
+        own: Tally = Tally()
+        total: Tally = Tally()
+        for stack, count in self._stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return {
+            "seconds": (self._ended or time.perf_counter()) - self._started,
+            "interval": self._interval,
+            "samples": self.samples,
+            "top_self": [{"function": name, "samples": count} for name, count in own.most_common(top)],
+            "top_total": [{"function": name, "samples": count} for name, count in total.most_common(top)],
+            "collapsed": "\n".join(f"{stack} {count}" for stack, count in self._stacks.most_common()),
+        }
+
+
+profiler = SamplingProfiler(max_seconds=PROFILE_MAX_SECONDS)
@@ -0,0 +1,103 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from bot import pipeline
+from bot.pipeline import ANY_RIGHTS, command
+
+ADMIN_ID = 10
+MEMBER_ID = 20
+
+
+class FakeMessage:
+    def __init__(self, user_id: int, *args: str):
+        self.chat = SimpleNamespace(id=-100)
+        self.from_user = SimpleNamespace(id=user_id)
+        self.command = ["cmd", *args]
+        self.replies = []
+
+    async def reply(self, text):
+        self.replies.append(text)
+
+
+@pytest.fixture
+def checks(monkeypatch):
+    """Replace the pipeline's lookups; each command gets one cooldown token."""
+    state = {"tokens": {}, "bot_admin": True, "target": 30, "roster_cached": True, "admin_lookups": 0}
+
+    def cached_is_admin(chat_id, user_id):
+        return user_id == ADMIN_ID if state["roster_cached"] else None
+
+    async def is_admin(client, chat_id, user_id):
+        state["admin_lookups"] += 1
+        return user_id == ADMIN_ID
+
+    async def check_cooldown(chat_id, user_id, name):
+        used = state["tokens"].get(user_id, 0)
+        state["tokens"][user_id] = used + 1
+        return used == 0
+
+    async def bot_can(client, chat_id, right):
+        return state["bot_admin"]
+
+    async def bot_is_admin(client, chat_id):
+        return state["bot_admin"]
+
+    async def get_target_user(client, message):
+        return state["target"]
+
+    for name, replacement in (("cached_is_admin", cached_is_admin), ("is_admin", is_admin),
+                              ("check_cooldown", check_cooldown), ("bot_can", bot_can),
+                              ("bot_is_admin", bot_is_admin), ("get_target_user", get_target_user)):
+        monkeypatch.setattr(pipeline, name, replacement)
+    return state
+
+
+def send(handler, message: FakeMessage):
+    asyncio.run(handler(None, message))
+    return message.replies
+
+
+def make_handler(**options):
+    @command("ban", **options)
+    async def handler(client, message, ctx):
+        await message.reply(f"done {ctx.target_id}")
+    return handler
+
+
+def test_non_admin_is_told_to_be_admin_before_cooldown(checks):
+    handler = make_handler(admin=True, bot_right="can_restrict_members", target=True)
+    for _ in range(3):
+        assert send(handler, FakeMessage(MEMBER_ID)) == ["You need to be an admin to use this command."]
+    # Refused callers never use up a cooldown token
+    assert MEMBER_ID not in checks["tokens"]
+
+    assert send(handler, FakeMessage(ADMIN_ID)) == ["done 30"]
+    assert send(handler, FakeMessage(ADMIN_ID)) == ["Please wait before using this command again."]
+    assert checks["admin_lookups"] == 0
+
+
+def test_cooldown_shields_uncached_admin_lookups(checks):
+    checks["roster_cached"] = False
+    handler = make_handler(admin=True, bot_right="can_restrict_members", target=True)
+    assert send(handler, FakeMessage(MEMBER_ID)) == ["You need to be an admin to use this command."]
+    for _ in range(3):
+        assert send(handler, FakeMessage(MEMBER_ID)) == ["Please wait before using this command again."]
+    # Only the command past the cooldown looked the caller up
+    assert checks["admin_lookups"] == 1
+
+
+def test_bot_right_replies_keep_their_wording(checks):
+    checks["bot_admin"] = False
+    restrict = make_handler(admin=True, bot_right="can_restrict_members", target=True)
+    assert send(restrict, FakeMessage(ADMIN_ID)) == ["I need admin rights to restrict members."]
+    checks["tokens"].clear()
+    warn = make_handler(admin=True, bot_right=ANY_RIGHTS, target=True)
+    assert send(warn, FakeMessage(ADMIN_ID)) == ["I need admin rights."]
+
+
+def test_target_checks_follow_bot_rights(checks):
+    checks["target"] = None
+    handler = make_handler(admin=True, bot_right="can_restrict_members", target=True)
+    assert send(handler, FakeMessage(ADMIN_ID)) == ["Please reply to a message or provide a username."]
@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+from bot.scheduler import OutboundScheduler, Priority
+
+CHAT = -100123
+
+
+def make_scheduler() -> OutboundScheduler:
+    return OutboundScheduler(
+        global_limit=(1000, 1), chat_limit=(3, 1), moderation_limit=(3, 1),
+        chat_budgets_size=100, max_retries=0, max_flood_wait=0,
+    )
+
+
+def run(scenario):
+    async def main():
+        scheduler = make_scheduler()
+        await scheduler.start()
+        try:
+            await scenario(scheduler)
+        finally:
+            await scheduler.stop()
+    asyncio.run(main())
+
+
+def sent(started: float):
+    async def call():
+        return time.monotonic() - started
+    return call
+
+
+def test_ban_is_not_delayed_by_queued_welcomes():
+    async def scenario(scheduler):
+        started = time.monotonic()
+        welcomes = [
+            asyncio.create_task(scheduler.submit(sent(started), "functions.messages.SendMessage", CHAT, Priority.LOW))
+            for _ in range(5)
+        ]
+        await asyncio.sleep(0.01)
+        ban = await scheduler.submit(sent(started), "functions.channels.EditBanned", CHAT, Priority.HIGH)
+        assert ban < 0.1
+        # The welcomes still share the chat's message budget
+        delays = sorted(await asyncio.gather(*welcomes))
+        assert delays[2] < 0.1 and delays[3] > 0.2
+    run(scenario)
+
+
+def test_moderation_calls_have_their_own_budget():
+    async def scenario(scheduler):
+        started = time.monotonic()
+        bans = await asyncio.gather(*(
+            scheduler.submit(sent(started), "functions.channels.EditBanned", CHAT, Priority.HIGH) for _ in range(4)
+        ))
+        assert sorted(bans)[2] < 0.1 and sorted(bans)[3] > 0.2
+        # Moderation in one chat leaves messages in it, and other chats, alone
+        reply = await scheduler.submit(sent(started), "functions.messages.SendMessage", CHAT)
+        other = await scheduler.submit(sent(started), "functions.channels.EditBanned", CHAT - 1, Priority.HIGH)
+        assert reply - bans[-1] < 0.1 and other - reply < 0.1
+    run(scenario)
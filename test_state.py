@@ -0,0 +1,138 @@
+import asyncio
+import socket
+import threading
+
+import pytest
+
+from bot.state import MemoryBackend, RedisBackend, StateBackend
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def fake_server_url():
+    """Run a local fake Redis server for the duration of the module."""
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    address = ("127.0.0.1", free_port())
+    server = fakeredis.TcpFakeServer(address, server_type="redis")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"redis://{address[0]}:{address[1]}/0"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["memory", "redis"])
+def make_backend(request):
+    """Return a factory for a backend of each kind, so every test runs against both."""
+    if request.param == "memory":
+        return lambda: MemoryBackend(resolution=0.05, slots=64)
+    url = request.getfixturevalue("fake_server_url")
+    return lambda: RedisBackend(url, prefix=f"test:{request.node.name}:")
+
+
+def run(make_backend, scenario):
+    async def main():
+        backend = make_backend()
+        await backend.start()
+        try:
+            await scenario(backend)
+        finally:
+            await backend.close()
+    asyncio.run(main())
+
+
+def test_take_token_limits_bursts(make_backend):
+    async def scenario(backend):
+        results = [await backend.take_token("cooldown:1:2:ban", 3, 60) for _ in range(5)]
+        assert results == [True, True, True, False, False]
+        # Other keys have their own bucket
+        assert await backend.take_token("cooldown:1:3:ban", 3, 60)
+    run(make_backend, scenario)
+
+
+def test_take_token_refills(make_backend):
+    async def scenario(backend):
+        assert await backend.take_token("cooldown:1:2:rules", 1, 0.2)
+        assert not await backend.take_token("cooldown:1:2:rules", 1, 0.2)
+        await asyncio.sleep(0.3)
+        assert await backend.take_token("cooldown:1:2:rules", 1, 0.2)
+    run(make_backend, scenario)
+
+
+def test_values(make_backend):
+    async def scenario(backend):
+        assert await backend.get("missing") is None
+        await backend.set("key", "value")
+        assert await backend.get("key") == "value"
+        await backend.delete("key")
+        assert await backend.get("key") is None
+
+        await backend.set("short", "value", ttl=0.1)
+        assert await backend.get("short") == "value"
+        await asyncio.sleep(0.2)
+        assert await backend.get("short") is None
+    run(make_backend, scenario)
+
+
+def test_publish_reaches_subscribers(make_backend):
+    async def scenario(backend):
+        received = []
+        backend.subscribe("invalidate", received.append)
+        # Give the subscription time to reach the server
+        await asyncio.sleep(0.2)
+        await backend.publish("invalidate", "first")
+        await backend.publish("other", "ignored")
+        for _ in range(50):
+            if received:
+                break
+            await asyncio.sleep(0.05)
+        assert received == ["first"]
+    run(make_backend, scenario)
+
+
+def test_invalidation_between_workers(fake_server_url):
+    """A message published by one worker reaches another worker's subscriber."""
+    async def main():
+        first = RedisBackend(fake_server_url, prefix="test:workers:")
+        second = RedisBackend(fake_server_url, prefix="test:workers:")
+        received = []
+        second.subscribe("invalidate", received.append)
+        await first.start()
+        await second.start()
+        try:
+            await asyncio.sleep(0.2)
+            await first.publish("invalidate", '{"cache": "admins", "key": 1}')
+            for _ in range(50):
+                if received:
+                    break
+                await asyncio.sleep(0.05)
+            assert received == ['{"cache": "admins", "key": 1}']
+        finally:
+            await first.close()
+            await second.close()
+    asyncio.run(main())
+
+
+def test_incomplete_backend_fails_on_construction():
+    """A backend missing a method is refused before it is ever used."""
+    class NoPubSub(StateBackend):
+        async def take_token(self, key, capacity, period):
+            return True
+
+        async def get(self, key):
+            return None
+
+        async def set(self, key, value, ttl=None):
+            pass
+
+        async def delete(self, key):
+            pass
+
+    with pytest.raises(TypeError):
+        NoPubSub()